@@ -1,4 +1,5 @@
 import numpy as np
+from geosolver.ontology.instantiator_arrays import InstanceArray, PointArray, LineArray, CircleArray, ArcArray
 from geosolver.ontology.instantiator_definitions import instantiators
 
 __author__ = 'minjoon'
@@ -32,7 +33,7 @@ def line_length(line):
 
 
 def line_vector(line):
-    array = (np.array(line[1]) - np.array(line[0]))
+    array = np.array([line.b.x - line.a.x, line.b.y - line.a.y])
     return array
 
 
@@ -51,24 +52,26 @@ def circumference(circle):
 
 
 def midpoint(p0, p1):
-    return instantiators['point'](*((np.array(p0) + np.array(p1))/2.0))
+    return instantiators['point']((p0.x + p1.x)/2.0, (p0.y + p1.y)/2.0)
 
 
 def distance_between_line_and_point(line, point):
     """
-    This function is slow... Please improve!
+    Distance between the line segment and the point.
+    Written with scalar arithmetic to avoid numpy overhead;
+    use distances_between_lines_and_points for many lines and points.
 
     :param line:
     :param point:
     :return:
     """
-    p = midpoint(line.a, line.b)
-    vector = point.x - p.x, point.y - p.y
-    u = line_unit_vector(line)
-    n = line_normal_vector(line)
-    perpendicular_distance = abs(np.dot(vector, n))
-    parallel_distance = abs(np.dot(vector, u))
-    if parallel_distance <= line_length(line)/2.0:
+    dx, dy = line.b.x - line.a.x, line.b.y - line.a.y
+    length = np.sqrt(dx**2 + dy**2)
+    ux, uy = dx/length, dy/length
+    vx, vy = point.x - (line.a.x + line.b.x)/2.0, point.y - (line.a.y + line.b.y)/2.0
+    perpendicular_distance = abs(vx*uy - vy*ux)
+    parallel_distance = abs(vx*ux + vy*uy)
+    if parallel_distance <= length/2.0:
         return perpendicular_distance
     else:
         return min(distance_between_points(point, line.a),
@@ -157,14 +160,50 @@ def intersections_between_circle_and_line(circle, line, eps):
 
     return sln
 
-def intersections_between_circles(circle0, circle1):
+def intersections_between_circles(circle0, circle1, eps):
     """
-    TO BE IMPLEMENTED
+    Intersections between two circles.
+    As in intersections_between_circle_and_line, circles that miss each other by at most eps are regarded as tangent,
+    and two intersections that are close (small angle at the center of the smaller circle) are merged.
+    Concentric circles have no intersection.
+
     :param circle0:
     :param circle1:
-    :return:
+    :param eps:
+    :return list:
     """
-    return []
+    min_angle = 30
+    center0, center1 = np.array(circle0.center, dtype=float), np.array(circle1.center, dtype=float)
+    r0, r1 = circle0.radius, circle1.radius
+    d = np.sqrt(np.sum((center1 - center0)**2))
+    if d == 0:
+        return []
+    u = (center1 - center0)/d
+    n = np.array([u[1], -u[0]])
+
+    if abs(r0 - r1) <= d <= r0 + r1:
+        a = (d**2 + r0**2 - r1**2)/(2*d)
+        h = np.sqrt(max(r0**2 - a**2, 0))
+        if h > 0:
+            sln = [instantiators['point'](*(center0 + a*u + h*n)), instantiators['point'](*(center0 + a*u - h*n))]
+        else:
+            sln = [instantiators['point'](*(center0 + a*u))]
+    # Error tolerant step
+    elif r0 + r1 < d <= r0 + r1 + eps:
+        sln = [instantiators['point'](*((center0 + r0*u + center1 - r1*u)/2.0))]
+    elif abs(r0 - r1) - eps <= d < abs(r0 - r1):
+        sign = 1 if r0 >= r1 else -1
+        sln = [instantiators['point'](*((center0 + sign*r0*u + center1 + sign*r1*u)/2.0))]
+    else:
+        sln = []
+
+    if len(sln) == 2:
+        center = circle0.center if r0 <= r1 else circle1.center
+        angle = instantiators['angle'](sln[0], center, sln[1])
+        if angle_in_degree(angle) < min_angle:
+            return [midpoint(sln[0], sln[1])]
+
+    return sln
 
 
 def angle_in_radian(angle, smaller=True):
@@ -209,4 +248,363 @@ def arc_midpoint(arc):
     cab = cartesian_angle(circle.center, arc.b)
     cam = (caa+cab)/2.0
     mp = instantiators['point'](radius*np.cos(cam), radius*np.sin(cam))
-    return mp
\ No newline at end of file
+    return mp
+
+
+"""
+Batched counterparts of the functions above.
+Each accepts an InstanceArray (e.g. LineArray), a list of instances, or a raw array with one row per instance,
+and returns a matrix with one row per instance of the first argument and one column per instance of the second.
+"""
+
+
+def distances_between_points(points0, points1):
+    p0 = _as_array(points0, PointArray)
+    p1 = _as_array(points1, PointArray)
+    dx = p0[:, np.newaxis, 0] - p1[np.newaxis, :, 0]
+    dy = p0[:, np.newaxis, 1] - p1[np.newaxis, :, 1]
+    return np.sqrt(dx**2 + dy**2)
+
+
+def distances_between_lines_and_points(lines, points):
+    """
+    (len(lines), len(points)) matrix of distance_between_line_and_point.
+
+    :param lines:
+    :param points:
+    :return np.ndarray:
+    """
+    l = _as_array(lines, LineArray)
+    p = _as_array(points, PointArray)
+    a, b = l[:, 0:2], l[:, 2:4]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        half_length = np.sqrt(np.sum((b - a)**2, 1))/2.0
+        u = (b - a)/(2*half_length[:, np.newaxis])
+    vx = p[np.newaxis, :, 0] - (a[:, np.newaxis, 0] + b[:, np.newaxis, 0])/2.0
+    vy = p[np.newaxis, :, 1] - (a[:, np.newaxis, 1] + b[:, np.newaxis, 1])/2.0
+    perpendicular_distance = np.abs(vx*u[:, np.newaxis, 1] - vy*u[:, np.newaxis, 0])
+    parallel_distance = np.abs(vx*u[:, np.newaxis, 0] + vy*u[:, np.newaxis, 1])
+    end_distance = np.minimum(distances_between_points(a, p), distances_between_points(b, p))
+    with np.errstate(invalid='ignore'):
+        return np.where(parallel_distance <= half_length[:, np.newaxis], perpendicular_distance, end_distance)
+
+
+def distances_between_circles_and_points(circles, points):
+    """
+    (len(circles), len(points)) matrix of distance_between_circle_and_point.
+
+    :param circles:
+    :param points:
+    :return np.ndarray:
+    """
+    c = _as_array(circles, CircleArray)
+    return np.abs(c[:, 2:3] - distances_between_points(c[:, 0:2], points))
+
+
+def distances_between_arcs_and_points(arcs, points):
+    """
+    (len(arcs), len(points)) matrix of distance_between_arc_and_point.
+
+    :param arcs:
+    :param points:
+    :return np.ndarray:
+    """
+    arc_array = _as_array(arcs, ArcArray)
+    p = _as_array(points, PointArray)
+    center = arc_array[:, 0:2]
+    angle_a = _cartesian_angles(center, arc_array[:, 3:5])[:, np.newaxis]
+    angle_b = _cartesian_angles(center, arc_array[:, 5:7])[:, np.newaxis]
+    angle_p = _cartesian_angles(center[:, np.newaxis, :], p[np.newaxis, :, :])
+    db = _signed_distances_between_cartesian_angles(angle_a, angle_b)
+    dp = _signed_distances_between_cartesian_angles(angle_a, angle_p)
+    circle_distance = distances_between_circles_and_points(arc_array[:, 0:3], p)
+    end_distance = np.minimum(distances_between_points(arc_array[:, 3:5], p),
+                              distances_between_points(arc_array[:, 5:7], p))
+    return np.where(dp <= db, circle_distance, end_distance)
+
+
+def intersections_between_lines_batch(lines0, lines1, eps):
+    """
+    Batched intersections_between_lines.
+    Returns (points, mask), where points[i, j] is the intersection between lines0[i] and lines1[j]
+    and mask[i, j] indicates whether it exists.
+
+    :param lines0:
+    :param lines1:
+    :param eps:
+    :return tuple:
+    """
+    l0 = _as_array(lines0, LineArray)[:, np.newaxis, :]
+    l1 = _as_array(lines1, LineArray)[np.newaxis, :, :]
+    return _intersections_between_lines(l0, l1, eps)
+
+
+def intersections_between_paired_lines(lines0, lines1, eps):
+    """
+    Pairwise intersections_between_lines.
+    Returns (points, mask), where points[i] is the intersection between lines0[i] and lines1[i]
+    and mask[i] indicates whether it exists.
+
+    :param lines0:
+    :param lines1:
+    :param eps:
+    :return tuple:
+    """
+    return _intersections_between_lines(_as_array(lines0, LineArray), _as_array(lines1, LineArray), eps)
+
+
+def _intersections_between_lines(l0, l1, eps):
+    shape = np.broadcast(l0[..., 0], l1[..., 0]).shape
+    x = l0[..., 0:2] - l1[..., 0:2]
+    d1 = l1[..., 2:4] - l1[..., 0:2]
+    d2 = l0[..., 2:4] - l0[..., 0:2]
+    cross = d1[..., 0]*d2[..., 1] - d1[..., 1]*d2[..., 0]
+    mask = np.abs(cross) >= eps
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t1 = (x[..., 0]*d2[..., 1] - x[..., 1]*d2[..., 0])/cross
+        points = np.where(mask[..., np.newaxis], l1[..., 0:2] + d1*t1[..., np.newaxis], 0)
+    with np.errstate(invalid='ignore'):
+        mask &= _distances_between_paired_lines_and_points(np.broadcast_to(l1, shape + (4,)), points) < eps
+        mask &= _distances_between_paired_lines_and_points(np.broadcast_to(l0, shape + (4,)), points) < eps
+    return points, mask
+
+
+def intersections_between_circles_and_lines_batch(circles, lines, eps):
+    """
+    Batched intersections_between_circle_and_line.
+    Returns (points, mask), where points[i, j, k] is the k-th (k = 0, 1) intersection
+    between circles[i] and lines[j], and mask[i, j, k] indicates whether it exists.
+
+    :param circles:
+    :param lines:
+    :param eps:
+    :return tuple:
+    """
+    c = _as_array(circles, CircleArray)[:, np.newaxis, :]
+    l = _as_array(lines, LineArray)[np.newaxis, :, :]
+    return _intersections_between_circles_and_lines(c, l, eps)
+
+
+def intersections_between_paired_circles_and_lines(circles, lines, eps):
+    """
+    Pairwise intersections_between_circle_and_line.
+    Returns (points, mask), where points[i, k] is the k-th (k = 0, 1) intersection
+    between circles[i] and lines[i], and mask[i, k] indicates whether it exists.
+
+    :param circles:
+    :param lines:
+    :param eps:
+    :return tuple:
+    """
+    return _intersections_between_circles_and_lines(_as_array(circles, CircleArray), _as_array(lines, LineArray), eps)
+
+
+def _intersections_between_circles_and_lines(c, l, eps):
+    min_angle = 30
+    shape = np.broadcast(c[..., 0], l[..., 0]).shape
+    center, radius = c[..., 0:2], c[..., 2]
+    a, b = l[..., 0:2], l[..., 2:4]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = (b - a)/np.sqrt(np.sum((b - a)**2, -1))[..., np.newaxis]
+    n = np.concatenate([u[..., 1:2], -u[..., 0:1]], -1)
+    d = np.sum(((a + b)/2.0 - center)*n, -1)
+    perp_vector = d[..., np.newaxis]*n
+
+    D = radius**2 - d**2
+    secant = D >= 0
+    tangent = ~secant & ((radius + eps)**2 - d**2 >= 0)
+    par_vector = np.sqrt(np.where(secant, D, 0))[..., np.newaxis]*u
+    points = np.empty(shape + (2, 2))
+    points[..., 0, :] = center + perp_vector + par_vector
+    points[..., 1, :] = center + perp_vector - par_vector
+    mask = np.empty(shape + (2,), dtype=bool)
+    mask[..., 0] = secant | tangent
+    mask[..., 1] = secant
+
+    full_lines = np.broadcast_to(l, shape + (4,))
+    with np.errstate(invalid='ignore'):
+        for k in range(2):
+            mask[..., k] &= _distances_between_paired_lines_and_points(full_lines, points[..., k, :]) < eps
+
+    # Nearly tangent secants are merged into their midpoint, as in the scalar function.
+    side_a = _norms(center - points[..., 1, :])
+    side_b = _norms(points[..., 1, :] - points[..., 0, :])
+    side_c = _norms(points[..., 0, :] - center)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        angle = 180*np.sqrt((side_a**2 + side_b**2 - side_c**2)/(2*side_a*side_b))/np.pi
+        merge = mask[..., 0] & mask[..., 1] & (angle < min_angle)
+    points[merge, 0] = (points[merge, 0] + points[merge, 1])/2.0
+    mask[merge, 1] = False
+    return points, mask
+
+
+def intersections_between_circles_batch(circles0, circles1, eps):
+    """
+    Batched intersections_between_circles.
+    Returns (points, mask), where points[i, j, k] is the k-th (k = 0, 1) intersection
+    between circles0[i] and circles1[j], and mask[i, j, k] indicates whether it exists.
+
+    :param circles0:
+    :param circles1:
+    :param eps:
+    :return tuple:
+    """
+    c0 = _as_array(circles0, CircleArray)[:, np.newaxis, :]
+    c1 = _as_array(circles1, CircleArray)[np.newaxis, :, :]
+    return _intersections_between_circles(c0, c1, eps)
+
+
+def intersections_between_paired_circles(circles0, circles1, eps):
+    """
+    Pairwise intersections_between_circles.
+    Returns (points, mask), where points[i, k] is the k-th (k = 0, 1) intersection
+    between circles0[i] and circles1[i], and mask[i, k] indicates whether it exists.
+
+    :param circles0:
+    :param circles1:
+    :param eps:
+    :return tuple:
+    """
+    return _intersections_between_circles(_as_array(circles0, CircleArray), _as_array(circles1, CircleArray), eps)
+
+
+def _intersections_between_circles(c0, c1, eps):
+    min_angle = 30
+    shape = np.broadcast(c0[..., 0], c1[..., 0]).shape
+    center0, r0 = np.broadcast_to(c0[..., 0:2], shape + (2,)), c0[..., 2]
+    center1, r1 = np.broadcast_to(c1[..., 0:2], shape + (2,)), c1[..., 2]
+    d = _norms(center1 - center0)
+    nonzero = d > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = np.where(nonzero[..., np.newaxis], (center1 - center0)/d[..., np.newaxis], 0)
+        a = np.where(nonzero, (d**2 + r0**2 - r1**2)/(2*d), 0)
+    n = np.concatenate([u[..., 1:2], -u[..., 0:1]], -1)
+
+    secant = nonzero & (np.abs(r0 - r1) <= d) & (d <= r0 + r1)
+    external = nonzero & (r0 + r1 < d) & (d <= r0 + r1 + eps)
+    internal = nonzero & (np.abs(r0 - r1) - eps <= d) & (d < np.abs(r0 - r1))
+    h = np.sqrt(np.where(secant, np.maximum(r0**2 - a**2, 0), 0))
+    sign = np.where(r0 >= r1, 1, -1)[..., np.newaxis]
+    external_points = (center0 + r0[..., np.newaxis]*u + center1 - r1[..., np.newaxis]*u)/2.0
+    internal_points = (center0 + sign*r0[..., np.newaxis]*u + center1 + sign*r1[..., np.newaxis]*u)/2.0
+    secant_points = center0 + a[..., np.newaxis]*u
+
+    points = np.zeros(shape + (2, 2))
+    points[..., 0, :] = np.where(secant[..., np.newaxis], secant_points + h[..., np.newaxis]*n,
+                                 np.where(external[..., np.newaxis], external_points,
+                                          np.where(internal[..., np.newaxis], internal_points, 0)))
+    points[..., 1, :] = np.where(secant[..., np.newaxis], secant_points - h[..., np.newaxis]*n, 0)
+    mask = np.empty(shape + (2,), dtype=bool)
+    mask[..., 0] = secant | external | internal
+    mask[..., 1] = secant & (h > 0)
+
+    # Nearly tangent secants are merged into their midpoint, as in the scalar function.
+    center = np.where((r0 <= r1)[..., np.newaxis], center0, center1)
+    side_a = _norms(center - points[..., 1, :])
+    side_b = _norms(points[..., 1, :] - points[..., 0, :])
+    side_c = _norms(points[..., 0, :] - center)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        angle = 180*np.sqrt((side_a**2 + side_b**2 - side_c**2)/(2*side_a*side_b))/np.pi
+        merge = mask[..., 0] & mask[..., 1] & (angle < min_angle)
+    points[merge, 0] = (points[merge, 0] + points[merge, 1])/2.0
+    mask[merge, 1] = False
+    return points, mask
+
+
+def line_bounding_boxes(lines, margin=0):
+    """
+    (N, 4) array of (x_min, y_min, x_max, y_max) of the line segments, expanded by margin on each side.
+
+    :param lines:
+    :param float margin:
+    :return np.ndarray:
+    """
+    l = _as_array(lines, LineArray)
+    return np.concatenate([np.minimum(l[:, 0:2], l[:, 2:4]) - margin, np.maximum(l[:, 0:2], l[:, 2:4]) + margin], 1)
+
+
+def circle_bounding_boxes(circles, margin=0):
+    """
+    (N, 4) array of (x_min, y_min, x_max, y_max) of the circles, expanded by margin on each side.
+
+    :param circles:
+    :param float margin:
+    :return np.ndarray:
+    """
+    c = _as_array(circles, CircleArray)
+    extent = c[:, 2:3] + margin
+    return np.concatenate([c[:, 0:2] - extent, c[:, 0:2] + extent], 1)
+
+
+def overlapping_bounding_box_pairs(boxes):
+    """
+    Sweep and prune: boxes are sorted by x_min, so the boxes overlapping box i in x are the ones whose x_min
+    lies in [x_min_i, x_max_i] in sorted order; those are then filtered by overlap in y.
+    Returns an (M, 2) array of index pairs (i, j), i < j, of overlapping boxes in lexicographic order.
+
+    :param np.ndarray boxes: (N, 4) array of (x_min, y_min, x_max, y_max)
+    :return np.ndarray:
+    """
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    order = np.argsort(boxes[:, 0], kind='mergesort')
+    sorted_boxes = boxes[order]
+    starts = np.arange(1, len(boxes) + 1)
+    ends = np.searchsorted(sorted_boxes[:, 0], sorted_boxes[:, 2], side='right')
+    counts = np.maximum(ends - starts, 0)
+    i = np.repeat(np.arange(len(boxes)), counts)
+    j = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+    overlap = (np.maximum(sorted_boxes[i, 1], sorted_boxes[j, 1]) <= np.minimum(sorted_boxes[i, 3], sorted_boxes[j, 3]))
+    pairs = np.sort(np.column_stack([order[i[overlap]], order[j[overlap]]]), 1)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def _distances_between_paired_lines_and_points(lines, points):
+    """
+    Elementwise distance_between_line_and_point between lines[..., :] and points[..., :].
+    """
+    a, b = lines[..., 0:2], lines[..., 2:4]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        half_length = _norms(b - a)/2.0
+        u = (b - a)/(2*half_length[..., np.newaxis])
+    v = points - (a + b)/2.0
+    perpendicular_distance = np.abs(v[..., 0]*u[..., 1] - v[..., 1]*u[..., 0])
+    parallel_distance = np.abs(v[..., 0]*u[..., 0] + v[..., 1]*u[..., 1])
+    end_distance = np.minimum(_norms(points - a), _norms(points - b))
+    with np.errstate(invalid='ignore'):
+        return np.where(parallel_distance <= half_length, perpendicular_distance, end_distance)
+
+
+def _norms(vectors):
+    return np.sqrt(vectors[..., 0]**2 + vectors[..., 1]**2)
+
+
+def _cartesian_angles(centers, points):
+    """
+    Elementwise cartesian_angle.
+    """
+    vx = points[..., 0] - centers[..., 0]
+    vy = points[..., 1] - centers[..., 1]
+    angles = np.arctan2(vy, vx)
+    angles = np.where((vx == 0) & (vy == 0), np.pi/2, angles)
+    return np.where(angles < 0, angles + 2*np.pi, angles)
+
+
+def _signed_distances_between_cartesian_angles(a0, a1):
+    distances = a1 - a0
+    return np.where(distances < 0, distances + 2*np.pi, distances)
+
+
+def _as_array(instances, array_class):
+    if isinstance(instances, InstanceArray):
+        return instances.array
+    if isinstance(instances, np.ndarray):
+        return instances.astype(np.float64).reshape(-1, array_class.width)
+    return _instance_array_constructors[array_class](instances).array
+
+
+_instance_array_constructors = {
+    PointArray: PointArray.from_points,
+    LineArray: LineArray.from_lines,
+    CircleArray: CircleArray.from_circles,
+    ArcArray: ArcArray.from_arcs,
+}
@@ -0,0 +1,65 @@
+"""
+Support of lines, arcs and circles scored on the Euclidean distance transform of a diagram segment.
+The distance transform is computed once per segment (see ImageSegment.distance_transform).
+A curve is sampled at unit spacing, and its support is the fraction of samples lying within eps of
+a foreground pixel. The cost is proportional to the length of the curve, not to the number of pixels.
+"""
+import cv2
+import numpy as np
+
+from geosolver.diagram.computational_geometry import line_length, cartesian_angle, \
+    signed_distance_between_cartesian_angles
+
+__author__ = 'minjoon'
+
+
+def get_distance_transform(pixel_array, shape):
+    """
+    Distance from each location of the segment to its nearest foreground pixel.
+
+    :param np.ndarray pixel_array: (N, 2) array of (x, y) of the foreground pixels
+    :param tuple shape: (height, width) of the segment
+    :return np.ndarray: float32 array of the given shape
+    """
+    background = np.full(shape, 255, dtype=np.uint8)
+    pixel_array = pixel_array.astype(int)
+    background[pixel_array[:, 1], pixel_array[:, 0]] = 0
+    return cv2.distanceTransform(background, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+
+
+def line_support(distance_transform, line, eps):
+    num = int(np.ceil(line_length(line))) + 1
+    t = np.linspace(0, 1, num)[:, np.newaxis]
+    points = (1 - t)*np.array([line.a.x, line.a.y]) + t*np.array([line.b.x, line.b.y])
+    return _support(distance_transform, points, eps)
+
+
+def arc_support(distance_transform, arc, eps):
+    circle = arc.circle
+    angle_a = cartesian_angle(circle.center, arc.a)
+    span = signed_distance_between_cartesian_angles(angle_a, cartesian_angle(circle.center, arc.b))
+    return _support(distance_transform, _get_circle_points(circle, angle_a, span), eps)
+
+
+def circle_support(distance_transform, circle, eps):
+    return _support(distance_transform, _get_circle_points(circle, 0, 2*np.pi), eps)
+
+
+def _get_circle_points(circle, start_angle, span):
+    num = int(np.ceil(span*circle.radius)) + 1
+    angles = start_angle + np.linspace(0, span, num)
+    return np.column_stack([circle.center.x + circle.radius*np.cos(angles),
+                            circle.center.y + circle.radius*np.sin(angles)])
+
+
+def _support(distance_transform, points, eps):
+    """
+    Fraction of points that are within eps of a foreground pixel.
+    Points outside of the segment are not supported.
+    """
+    height, width = distance_transform.shape
+    indices = np.round(points).astype(int)
+    inside = (indices[:, 0] >= 0) & (indices[:, 0] < width) & (indices[:, 1] >= 0) & (indices[:, 1] < height)
+    supported = np.zeros(len(points), dtype=bool)
+    supported[inside] = distance_transform[indices[inside, 1], indices[inside, 0]] <= eps
+    return float(np.count_nonzero(supported))/len(points)
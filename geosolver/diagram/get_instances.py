@@ -16,6 +16,61 @@ def get_instances(graph_parse, instance_type_name, is_variable=False, *args):
 
 
 def get_all_instances(graph_parse, instance_type_name, is_variable=False):
+    """
+    All instances of the type in graph_parse, as a dictionary from key to instance.
+    Instances of each (instance_type_name, is_variable) are enumerated once and cached in graph_parse.instance_catalog.
+
+    :param GraphParse graph_parse:
+    :param str instance_type_name:
+    :param bool is_variable:
+    :return dict:
+    """
+    return dict(_get_catalog(graph_parse, instance_type_name, is_variable))
+
+
+def get_instances_with_point(graph_parse, instance_type_name, point_key, is_variable=False):
+    """
+    Instances of the type that contain the point (as an end point, vertex or center),
+    looked up in a reverse index cached in graph_parse.point_instance_index.
+
+    :param GraphParse graph_parse:
+    :param str instance_type_name:
+    :param point_key:
+    :param bool is_variable:
+    :return dict:
+    """
+    catalog = _get_catalog(graph_parse, instance_type_name, is_variable)
+    catalog_key = (instance_type_name, is_variable)
+    if catalog_key not in graph_parse.point_instance_index:
+        index = {}
+        for key in catalog:
+            for each_point_key in _get_point_keys(instance_type_name, key):
+                index.setdefault(each_point_key, []).append(key)
+        graph_parse.point_instance_index[catalog_key] = index
+    return {key: catalog[key] for key in graph_parse.point_instance_index[catalog_key].get(point_key, [])}
+
+
+def _get_catalog(graph_parse, instance_type_name, is_variable):
+    assert isinstance(graph_parse, GraphParse)
+    catalog_key = (instance_type_name, is_variable)
+    if catalog_key not in graph_parse.instance_catalog:
+        graph_parse.instance_catalog[catalog_key] = _get_all_instances(graph_parse, instance_type_name, is_variable)
+    return graph_parse.instance_catalog[catalog_key]
+
+
+def _get_point_keys(instance_type_name, key):
+    if instance_type_name == 'point':
+        return [key]
+    elif instance_type_name == 'circle':
+        return [key[0]]
+    elif instance_type_name == 'arc':
+        (center_key, _), a_key, b_key = key
+        return set([center_key, a_key, b_key])
+    else:
+        return set(key)
+
+
+def _get_all_instances(graph_parse, instance_type_name, is_variable):
     assert instance_type_name in instantiators
     if instance_type_name in ["triangle", "quad", "hexagon"]:
         if instance_type_name == 'triangle': n = 3
@@ -89,7 +144,7 @@ def _get_all_circles(graph_parse, is_variable):
 def _get_arcs(graph_parse, is_variable, a_key, b_key):
     assert isinstance(graph_parse, GraphParse)
     arcs = {}
-    for circle_key in _get_all_circles(graph_parse):
+    for circle_key in _get_all_circles(graph_parse, is_variable):
         if graph_parse.arc_graphs[circle_key].has_edge(a_key, b_key):
             if is_variable:
                 arc = graph_parse.arc_graphs[circle_key][a_key][b_key]['variable']
@@ -101,11 +156,25 @@ def _get_arcs(graph_parse, is_variable, a_key, b_key):
 
 
 def _get_all_arcs(graph_parse, is_variable):
+    """
+    Arcs are read off the edges of each circle's arc graph.
+
+    :param graph_parse:
+    :param is_variable:
+    :return:
+    """
     assert isinstance(graph_parse, GraphParse)
-    items = []
-    for a_key, b_key in itertools.permutations(graph_parse.intersection_points, 2):
-        items.extend(_get_arcs(graph_parse, is_variable, a_key, b_key).iteritems())
-    return dict(items)
+    arcs = {}
+    for circle_key, arc_graph in graph_parse.arc_graphs.iteritems():
+        for a_key, b_key, data in arc_graph.edges(data=True):
+            if a_key == b_key or a_key not in graph_parse.intersection_points or \
+                    b_key not in graph_parse.intersection_points:
+                continue
+            if is_variable:
+                arcs[(circle_key, a_key, b_key)] = data['variable']
+            else:
+                arcs[(circle_key, a_key, b_key)] = data['instance']
+    return arcs
 
 def _get_polygons(graph_parse, name, is_variable, *args):
     # TODO : include ignore_trivial parameter. This ignores area-0 polygons.
@@ -123,14 +192,21 @@ def _get_polygons(graph_parse, name, is_variable, *args):
         return {}
 
 def _get_all_polygons(graph_parse, name, n, is_variable):
+    """
+    Polygons are the simple cycles of length n in line_graph whose every vertex forms a non-trivial angle.
+    For each set of vertices, only the first such cycle (in the order of intersection_points) is kept.
+
+    :param graph_parse:
+    :param name:
+    :param n:
+    :param is_variable:
+    :return:
+    """
     polygons = {}
     frozensets = set()
-    line_graph = graph_parse.line_graph
-    for keys in itertools.permutations(graph_parse.intersection_points, n):
+    for keys in _get_cycles(graph_parse.line_graph, graph_parse.intersection_points.keys(), n):
         if frozenset(keys) in frozensets:
             continue
-        if not all(line_graph.has_edge(keys[idx-1], key) for idx, key in enumerate(keys)):
-            continue
 
         angles = []
         for idx, key in enumerate(keys):
@@ -149,6 +225,42 @@ def _get_all_polygons(graph_parse, name, n, is_variable):
     return polygons
 
 
+def _get_cycles(graph, keys, n):
+    """
+    Yields simple cycles of length n in the undirected graph as tuples of nodes, in lexicographic order of
+    their positions in keys. Each cycle starts at its lowest-positioned node, and is yielded in both directions.
+    Only existing edges are walked, so the cost grows with the density of the graph rather than len(keys)**n.
+
+    :param networkx.Graph graph:
+    :param list keys:
+    :param int n:
+    :return:
+    """
+    positions = {key: idx for idx, key in enumerate(keys)}
+    neighbors = {key: sorted((neighbor for neighbor in graph[key] if neighbor in positions), key=positions.get)
+                 for key in keys if key in graph}
+
+    def extend(path, visited):
+        last = path[-1]
+        for neighbor in neighbors[last]:
+            if positions[neighbor] <= positions[path[0]] or neighbor in visited:
+                continue
+            path.append(neighbor)
+            if len(path) == n:
+                if graph.has_edge(neighbor, path[0]):
+                    yield tuple(path)
+            else:
+                visited.add(neighbor)
+                for cycle in extend(path, visited):
+                    yield cycle
+                visited.remove(neighbor)
+            path.pop()
+
+    for key in keys:
+        if key in neighbors:
+            for cycle in extend([key], {key}):
+                yield cycle
+
 
 def _get_angles(graph_parse, is_variable, a_key, b_key, c_key, ignore_trivial=True):
     assert isinstance(graph_parse, GraphParse)
@@ -183,12 +295,18 @@ def _get_angles(graph_parse, is_variable, a_key, b_key, c_key, ignore_trivial=Tr
 def _get_all_angles(graph_parse, is_variable, ignore_trivial=True):
     """
     If ignore_trival is set to true, then 0 degree / 360 degree angles are not considered.
+    Only pairs of line_graph neighbors of each vertex are considered.
     :param graph_parse:
     :param ignore_trival:
     :return:
     """
     assert isinstance(graph_parse, GraphParse)
+    line_graph = graph_parse.line_graph
     items = []
-    for a_key, b_key, c_key in itertools.permutations(graph_parse.intersection_points, 3):
-        items.extend(_get_angles(graph_parse, is_variable, a_key, b_key, c_key, ignore_trivial=ignore_trivial).iteritems())
+    for b_key in graph_parse.intersection_points:
+        if b_key not in line_graph:
+            continue
+        neighbors = [key for key in line_graph[b_key] if key != b_key and key in graph_parse.intersection_points]
+        for a_key, c_key in itertools.permutations(neighbors, 2):
+            items.extend(_get_angles(graph_parse, is_variable, a_key, b_key, c_key, ignore_trivial=ignore_trivial).iteritems())
     return dict(items)
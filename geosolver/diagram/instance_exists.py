@@ -6,12 +6,14 @@ Exists returns True / False
 """
 import numpy as np
 
-from geosolver.diagram.computational_geometry import line_length, line_unit_vector, distance_between_points, \
-    distance_between_line_and_point, distance_between_arc_and_point, arc_length, distance_between_circle_and_point, \
-    circumference
+from geosolver.diagram.computational_geometry import line_length, distance_between_points, arc_length, \
+    circumference, distances_between_lines_and_points, distances_between_arcs_and_points, \
+    distances_between_circles_and_points
 from geosolver.diagram.states import CoreParse
 from geosolver.ontology.instantiator_definitions import instantiators
+from geosolver.diagram.distance_transform import line_support, arc_support, circle_support
 from geosolver.parameters import LINE_EPS
+import geosolver.parameters as params
 
 __author__ = 'minjoon'
 
@@ -28,10 +30,13 @@ def _line_exists(diagram_parse, line):
     eps = LINE_EPS
     multiplier = 1.0
     assert isinstance(diagram_parse, CoreParse)
-    pixels = diagram_parse.primitive_parse.image_segment_parse.diagram_image_segment.pixels
-    near_pixels = set(pixel for pixel in pixels if distance_between_line_and_point(line, pixel) <= eps)
+    if params.SUPPORT_BACKEND == 'distance_transform':
+        return line_support(_get_distance_transform(diagram_parse), line, eps) >= params.DISTANCE_TRANSFORM_MIN_SUPPORT
+    image_segment = diagram_parse.primitive_parse.image_segment_parse.diagram_image_segment
+    pixels = _get_candidate_pixels(image_segment, image_segment.pixel_grid.query_line(line, eps))
+    num_near_pixels = np.count_nonzero(distances_between_lines_and_points([line], pixels)[0] <= eps)
     length = line_length(line)
-    ratio = float(len(near_pixels))/length
+    ratio = float(num_near_pixels)/length
     if ratio < multiplier:
         return False
     return True
@@ -41,10 +46,13 @@ def _arc_exists(diagram_parse, arc):
     eps = 4
     multiplier = 1
     assert isinstance(diagram_parse, CoreParse)
-    pixels = diagram_parse.primitive_parse.image_segment_parse.diagram_image_segment.pixels
-    near_pixels = set(pixel for pixel in pixels if distance_between_arc_and_point(arc, pixel) <= eps)
+    if params.SUPPORT_BACKEND == 'distance_transform':
+        return arc_support(_get_distance_transform(diagram_parse), arc, eps) >= params.DISTANCE_TRANSFORM_MIN_SUPPORT
+    image_segment = diagram_parse.primitive_parse.image_segment_parse.diagram_image_segment
+    pixels = _get_candidate_pixels(image_segment, image_segment.pixel_grid.query_arc(arc, eps))
+    num_near_pixels = np.count_nonzero(distances_between_arcs_and_points([arc], pixels)[0] <= eps)
     length = arc_length(arc)
-    ratio = float(len(near_pixels))/length
+    ratio = float(num_near_pixels)/length
     if ratio < multiplier:
         return False
     return True
@@ -54,12 +62,31 @@ def _circle_exists(diagram_parse, circle):
     eps = 4
     multiplier = 2
     assert isinstance(diagram_parse, CoreParse)
-    pixels = diagram_parse.primitive_parse.image_segment_parse.diagram_image_segment.pixels
-    near_pixels = set(pixel for pixel in pixels if distance_between_circle_and_point(circle, pixel) <= eps)
+    if params.SUPPORT_BACKEND == 'distance_transform':
+        return circle_support(_get_distance_transform(diagram_parse), circle, eps) >= params.DISTANCE_TRANSFORM_MIN_SUPPORT
+    image_segment = diagram_parse.primitive_parse.image_segment_parse.diagram_image_segment
+    pixels = _get_candidate_pixels(image_segment, image_segment.pixel_grid.query_circle(circle, eps))
+    num_near_pixels = np.count_nonzero(distances_between_circles_and_points([circle], pixels)[0] <= eps)
     length = circumference(circle)
-    if len(near_pixels) < multiplier*length:
+    if num_near_pixels < multiplier*length:
         return False
     return True
 
+def _get_distance_transform(diagram_parse):
+    return diagram_parse.primitive_parse.image_segment_parse.diagram_image_segment.distance_transform
+
+
+def _get_candidate_pixels(image_segment, indices):
+    """
+    Pixels of the image segment at indices, as an (len(indices), 2) array.
+    Indices come from image_segment.pixel_grid, so only pixels in the corridor of the instance are tested.
+
+    :param ImageSegment image_segment:
+    :param np.ndarray indices:
+    :return np.ndarray:
+    """
+    return image_segment.pixel_grid.pixel_array[indices]
+
+
 def _distance_to_closest_point(point, points):
     return min(distance_between_points(point, p) for p in points)
@@ -0,0 +1,184 @@
+"""
+Content-addressed on-disk cache of the diagram parsing stages.
+The outputs of parse_primitives, select_primitives, parse_core and parse_graph are stored in one compressed npz file,
+named by a hash of the diagram image and of the values in geosolver.parameters,
+so changing any parameter (or bumping CACHE_VERSION when the parsing code changes) invalidates old entries.
+Image segments are not stored; parse_image_segments is rerun on load to recover the images.
+"""
+import hashlib
+import os
+import tempfile
+import types
+
+import networkx as nx
+import numpy as np
+
+import geosolver.parameters as params
+from geosolver.diagram.parse_core import _get_core_parse
+from geosolver.diagram.parse_graph import _get_circle_entry, _add_line_edge, _add_arc_edge
+from geosolver.diagram.parse_image_segments import parse_image_segments
+from geosolver.diagram.states import PrimitiveParse, GraphParse
+from geosolver.ontology.instantiator_arrays import LineArray, CircleArray, PointArray
+from geosolver.settings import DIAGRAM_CACHE_DIR
+
+__author__ = 'minjoon'
+
+CACHE_VERSION = 1
+
+
+def get_cache_key(diagram):
+    """
+    Hash of the diagram image, the parameters and CACHE_VERSION.
+
+    :param np.ndarray diagram:
+    :return str:
+    """
+    sha = hashlib.sha1()
+    sha.update("%d %r %s\n" % (CACHE_VERSION, diagram.shape, diagram.dtype))
+    sha.update(np.ascontiguousarray(diagram).tobytes())
+    sha.update(_get_parameters_string())
+    return sha.hexdigest()
+
+
+def save_parses(diagram, primitive_parse, selected_primitive_parse, graph_parse, cache_dir=DIAGRAM_CACHE_DIR):
+    """
+    Stores the outputs of the parsing stages of the diagram.
+
+    :param np.ndarray diagram:
+    :param PrimitiveParse primitive_parse: output of parse_primitives
+    :param PrimitiveParse selected_primitive_parse: output of select_primitives
+    :param GraphParse graph_parse: output of parse_graph (its core_parse is the output of parse_core)
+    :param str cache_dir:
+    :return str: path to the cache file
+    """
+    core_parse = graph_parse.core_parse
+    arrays = {}
+    arrays.update(_get_primitive_arrays('primitive', primitive_parse))
+    arrays['selected_keys'] = np.array(sorted(selected_primitive_parse.primitives), dtype=int)
+
+    point_keys = sorted(core_parse.intersection_points)
+    arrays['point_keys'] = np.array(point_keys, dtype=int)
+    arrays['points'] = PointArray.from_points(core_parse.intersection_points[key] for key in point_keys).array
+    circle_keys = sorted((center_key, radius_key)
+                         for center_key, d in core_parse.circles.iteritems() for radius_key in d)
+    arrays['circle_keys'] = np.array(circle_keys, dtype=int).reshape(-1, 2)
+    arrays['circles'] = CircleArray.from_circles(core_parse.circles[center_key][radius_key]
+                                                 for center_key, radius_key in circle_keys).array
+
+    line_edges = graph_parse.line_graph.edges(data=True)
+    arrays['line_edges'] = np.array([(key0, key1) for key0, key1, _ in line_edges], dtype=int).reshape(-1, 2)
+    arrays['line_edge_points'] = _get_membership_array(data['points'] for _, _, data in line_edges)
+    arrays['circle_points'] = _get_membership_array(graph_parse.circle_dict[center_key][radius_key]['points']
+                                                    for center_key, radius_key in circle_keys)
+    arc_edges = [(circle_idx, key0, key1, data)
+                 for circle_idx, circle_key in enumerate(circle_keys)
+                 for key0, key1, data in graph_parse.arc_graphs[circle_key].edges(data=True)]
+    arrays['arc_edges'] = np.array([arc_edge[:3] for arc_edge in arc_edges], dtype=int).reshape(-1, 3)
+    arrays['arc_edge_points'] = _get_membership_array(data['points'] for _, _, _, data in arc_edges)
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    path = _get_cache_path(diagram, cache_dir)
+    fd, temp_path = tempfile.mkstemp(suffix=".npz", dir=cache_dir)
+    with os.fdopen(fd, 'wb') as fp:
+        np.savez_compressed(fp, **arrays)
+    os.rename(temp_path, path)
+    return path
+
+
+def load_parses(diagram, cache_dir=DIAGRAM_CACHE_DIR):
+    """
+    Loads the outputs of the parsing stages of the diagram, or returns None if they are not cached.
+
+    :param np.ndarray diagram:
+    :param str cache_dir:
+    :return tuple: (primitive_parse, selected_primitive_parse, core_parse, graph_parse)
+    """
+    path = _get_cache_path(diagram, cache_dir)
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as data:
+        arrays = dict(data.items())
+
+    image_segment_parse = parse_image_segments(diagram)
+    primitive_parse = _get_primitive_parse(image_segment_parse, 'primitive', arrays)
+    selected_keys = set(arrays['selected_keys'].tolist())
+    selected_primitive_parse = PrimitiveParse(image_segment_parse,
+                                              {key: line for key, line in primitive_parse.lines.iteritems()
+                                               if key in selected_keys},
+                                              {key: circle for key, circle in primitive_parse.circles.iteritems()
+                                               if key in selected_keys})
+
+    point_keys = arrays['point_keys'].tolist()
+    intersections = dict(zip(point_keys, PointArray(arrays['points'])))
+    circle_keys = [tuple(circle_key) for circle_key in arrays['circle_keys'].tolist()]
+    circles = {}
+    for (center_key, radius_key), circle in zip(circle_keys, CircleArray(arrays['circles'])):
+        circles.setdefault(center_key, {})[radius_key] = circle
+    core_parse = _get_core_parse(selected_primitive_parse, intersections, circles)
+
+    line_graph = nx.Graph()
+    line_edge_points = _get_memberships(core_parse, arrays['line_edge_points'], len(arrays['line_edges']))
+    for (key0, key1), points in zip(arrays['line_edges'].tolist(), line_edge_points):
+        _add_line_edge(line_graph, core_parse, key0, key1, points)
+
+    circle_dict = {}
+    arc_graphs = {}
+    circle_points = _get_memberships(core_parse, arrays['circle_points'], len(circle_keys))
+    for (center_key, radius_key), points in zip(circle_keys, circle_points):
+        circle_dict.setdefault(center_key, {})[radius_key] = _get_circle_entry(core_parse, center_key, radius_key,
+                                                                               points)
+        arc_graphs[(center_key, radius_key)] = nx.DiGraph()
+    arc_edge_points = _get_memberships(core_parse, arrays['arc_edge_points'], len(arrays['arc_edges']))
+    for (circle_idx, key0, key1), points in zip(arrays['arc_edges'].tolist(), arc_edge_points):
+        center_key, radius_key = circle_keys[circle_idx]
+        d = circle_dict[center_key][radius_key]
+        _add_arc_edge(arc_graphs[(center_key, radius_key)], core_parse, d['instance'], d['variable'], key0, key1,
+                      points)
+
+    graph_parse = GraphParse(core_parse, line_graph, circle_dict, arc_graphs)
+    return primitive_parse, selected_primitive_parse, core_parse, graph_parse
+
+
+def _get_cache_path(diagram, cache_dir):
+    return os.path.join(cache_dir, "%s.npz" % get_cache_key(diagram))
+
+
+def _get_parameters_string():
+    items = []
+    for name in sorted(dir(params)):
+        value = getattr(params, name)
+        if name.startswith('_') or isinstance(value, (type, types.ModuleType)) or callable(value):
+            continue
+        items.append("%s=%r" % (name, value))
+    return "\n".join(items)
+
+
+def _get_primitive_arrays(prefix, primitive_parse):
+    line_keys = sorted(primitive_parse.lines)
+    circle_keys = sorted(primitive_parse.circles)
+    return {'%s_line_keys' % prefix: np.array(line_keys, dtype=int),
+            '%s_lines' % prefix: LineArray.from_lines(primitive_parse.lines[key] for key in line_keys).array,
+            '%s_circle_keys' % prefix: np.array(circle_keys, dtype=int),
+            '%s_circles' % prefix: CircleArray.from_circles(primitive_parse.circles[key] for key in circle_keys).array}
+
+
+def _get_primitive_parse(image_segment_parse, prefix, arrays):
+    lines = dict(zip(arrays['%s_line_keys' % prefix].tolist(), LineArray(arrays['%s_lines' % prefix])))
+    circles = dict(zip(arrays['%s_circle_keys' % prefix].tolist(), CircleArray(arrays['%s_circles' % prefix])))
+    return PrimitiveParse(image_segment_parse, lines, circles)
+
+
+def _get_membership_array(points_dicts):
+    """
+    (N, 2) array of (index, point key) for each point key in each of the dictionaries.
+    """
+    return np.array([(idx, key) for idx, points in enumerate(points_dicts) for key in sorted(points)],
+                    dtype=int).reshape(-1, 2)
+
+
+def _get_memberships(core_parse, membership_array, num):
+    memberships = [{} for _ in range(num)]
+    for idx, key in membership_array.tolist():
+        memberships[idx][key] = core_parse.intersection_points[key]
+    return memberships
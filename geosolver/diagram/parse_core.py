@@ -1,11 +1,15 @@
 import itertools
 
+import numpy as np
 from sklearn.cluster import KMeans
 
+from geosolver.diagram.stage_stats import start_stage, end_stage
 from geosolver.diagram.states import PrimitiveParse, CoreParse
 from geosolver.ontology.instantiator_definitions import instantiators
-from geosolver.diagram.computational_geometry import intersections_between_lines, intersections_between_circle_and_line, \
-    intersections_between_circles, distance_between_points
+from geosolver.diagram.computational_geometry import distances_between_points, intersections_between_paired_lines, \
+    intersections_between_paired_circles_and_lines, intersections_between_paired_circles, line_bounding_boxes, \
+    circle_bounding_boxes, overlapping_bounding_box_pairs
+from geosolver.ontology.instantiator_arrays import LineArray, CircleArray
 import geosolver.parameters as params
 from geosolver.text2.ontology import VariableSignature, FormulaNode
 
@@ -13,9 +17,27 @@ __author__ = 'minjoon'
 
 
 def parse_core(primitive_parse):
+    start_time = start_stage()
     all_intersections = _get_all_intersections(primitive_parse, params.INTERSECTION_EPS)
-    clustered_intersections = _cluster_intersections(all_intersections, params.KMEANS_RADIUS_THRESHOLD)
+    clustered_intersections = _cluster_intersections(all_intersections, params.KMEANS_RADIUS_THRESHOLD,
+                                                     params.INTERSECTION_CLUSTERING)
     intersections = dict(enumerate(clustered_intersections))
+    circles = _get_circles(primitive_parse, intersections)
+    core_parse = _get_core_parse(primitive_parse, intersections, circles)
+    end_stage('parse_core', core_parse, start_time, num_intersections=len(all_intersections),
+              num_clusters=len(clustered_intersections), num_circles=sum(len(d) for d in circles.values()))
+    return core_parse
+
+
+def _get_core_parse(primitive_parse, intersections, circles):
+    """
+    Creates the point and radius variables of the intersections and circles, and their initial assignment.
+
+    :param PrimitiveParse primitive_parse:
+    :param dict intersections: {point_key: point}
+    :param dict circles: {point_key: {radius_key: circle}}
+    :return CoreParse:
+    """
     assignment = {}
     point_variables = {}
     for idx in intersections.keys():
@@ -23,7 +45,6 @@ def parse_core(primitive_parse):
         vs = VariableSignature(id_, 'point')
         point_variables[idx] = FormulaNode(vs, [])
         assignment[id_] = intersections[idx]
-    circles = _get_circles(primitive_parse, intersections)
     radius_variables = {}
     for point_idx, d in circles.iteritems():
         radius_variables[point_idx] = {}
@@ -37,11 +58,39 @@ def parse_core(primitive_parse):
 
 
 def _get_all_intersections(primitive_parse, eps):
+    """
+    Intersections between all pairs of primitives, and the end points of lines and the centers of circles.
+    Only pairs whose bounding boxes (expanded by eps) overlap are tested (see overlapping_bounding_box_pairs),
+    in one batched call per pair of primitive types.
+
+    :param PrimitiveParse primitive_parse:
+    :param float eps:
+    :return list:
+    """
     assert isinstance(primitive_parse, PrimitiveParse)
 
+    lines = LineArray.from_lines(primitive_parse.lines.values()).array
+    circles = CircleArray.from_circles(primitive_parse.circles.values()).array
+    boxes = np.concatenate([line_bounding_boxes(lines, eps), circle_bounding_boxes(circles, eps)])
+    pairs = overlapping_bounding_box_pairs(boxes)
+    num_lines = len(lines)
+    line_pairs = pairs[pairs[:, 1] < num_lines]
+    circle_line_pairs = pairs[(pairs[:, 0] < num_lines) & (pairs[:, 1] >= num_lines)]
+    circle_line_pairs = circle_line_pairs[np.lexsort((circle_line_pairs[:, 0], circle_line_pairs[:, 1]))]
+    circle_pairs = pairs[pairs[:, 0] >= num_lines] - num_lines
+
     intersections = []
-    for pr0, pr1 in itertools.combinations(primitive_parse.primitives.values(), 2):
-        intersections.extend(_get_intersections_between_primitives(pr0, pr1, eps))
+    if len(line_pairs) > 0:
+        points, mask = intersections_between_paired_lines(lines[line_pairs[:, 0]], lines[line_pairs[:, 1]], eps)
+        intersections.extend(instantiators['point'](*point) for point in points[mask].tolist())
+    if len(circle_line_pairs) > 0:
+        points, mask = intersections_between_paired_circles_and_lines(circles[circle_line_pairs[:, 1] - num_lines],
+                                                                      lines[circle_line_pairs[:, 0]], eps)
+        intersections.extend(instantiators['point'](*point) for point in points[mask].tolist())
+    if len(circle_pairs) > 0:
+        points, mask = intersections_between_paired_circles(circles[circle_pairs[:, 0]], circles[circle_pairs[:, 1]],
+                                                            eps)
+        intersections.extend(instantiators['point'](*point) for point in points[mask].tolist())
 
     for line in primitive_parse.lines.values():
         intersections.extend(line)
@@ -52,7 +101,28 @@ def _get_all_intersections(primitive_parse, eps):
     return intersections
 
 
-def _cluster_intersections(intersections, radius_threshold):
+def _cluster_intersections(intersections, radius_threshold, method='kmeans'):
+    """
+    Clusters intersections so that every cluster's radius (distance from its center to its farthest member)
+    is at most radius_threshold, and returns the cluster centers.
+    method is either 'kmeans' (see _cluster_intersections_kmeans) or 'radius' (see _cluster_intersections_radius).
+
+    :param intersections:
+    :param radius_threshold:
+    :param method:
+    :return:
+    """
+    if len(intersections) == 0:
+        return []
+    if method == 'kmeans':
+        return _cluster_intersections_kmeans(intersections, radius_threshold)
+    elif method == 'radius':
+        return _cluster_intersections_radius(intersections, radius_threshold)
+    else:
+        raise Exception(method)
+
+
+def _cluster_intersections_kmeans(intersections, radius_threshold):
     """
     Increase number of clusters until all clusters' radius < radius_threshold
     Stop right away
@@ -61,48 +131,126 @@ def _cluster_intersections(intersections, radius_threshold):
     :param sigma_threshold:
     :return:
     """
-    if len(intersections) == 0:
-        return []
     n = 1
     while True:
         km = KMeans(n)
         assignments = km.fit_predict(intersections)
         centers = [instantiators['point'](*p) for p in km.cluster_centers_]
-        radii = []
-        for center_idx, center in enumerate(centers):
-            curr_points = [p for idx, p in enumerate(intersections) if assignments[idx] == center_idx]
-            radius = _get_radius(center, curr_points)
-            radii.append(radius)
-        if max(radii) <= radius_threshold:
+        distances = distances_between_points(km.cluster_centers_, intersections)
+        radius = max(distances[center_idx, assignments == center_idx].max() for center_idx in range(len(centers)))
+        if radius <= radius_threshold:
             return centers
         else:
             n += 1
 
-def _get_radius(center, points):
-    return max(distance_between_points(center, point) for point in points)
-
 
-def _get_intersections_between_primitives(obj0, obj1, eps):
+def _cluster_intersections_radius(intersections, radius_threshold):
     """
-    Intersections between two primitives
-    :param obj0:
-    :param obj1:
+    Single-pass radius-bounded clustering.
+    Points are first assigned to leaders (see _get_leader_clusters).
+    A cluster whose radius around its mean exceeds radius_threshold is re-clustered with half the leader radius;
+    then all members are within radius_threshold/2 of the leader and hence within radius_threshold of the mean.
+    Finally, nearby clusters are merged greedily (closest first) if the merged cluster still satisfies the bound,
+    which keeps the number of clusters close to that found by KMeans.
+    Near-linear in the number of intersections since neighbors are found by grid hashing.
+
+    :param intersections:
+    :param radius_threshold:
     :return:
     """
-    is_line0 = isinstance(obj0, instantiators['line'])
-    is_circle0 = isinstance(obj0, instantiators['circle'])
-    is_line1 = isinstance(obj1, instantiators['line'])
-    is_circle1 = isinstance(obj1, instantiators['circle'])
-    if is_line0 and is_line1:
-        return intersections_between_lines(obj0, obj1, eps)
-    elif is_line0 and is_circle1:
-        return intersections_between_circle_and_line(obj1, obj0, eps)
-    elif is_circle0 and is_line1:
-        return intersections_between_circle_and_line(obj0, obj1, eps)
-    elif is_circle0 and is_circle1:
-        return intersections_between_circles(obj0, obj1)
-    else:
-        raise Exception()
+    points = np.array([(point.x, point.y) for point in intersections], dtype=float)
+    clusters = _get_bounded_clusters(points, np.arange(len(points)), radius_threshold, radius_threshold)
+    clusters = _merge_clusters(points, clusters, radius_threshold)
+    return [instantiators['point'](*points[members].mean(0)) for members in clusters]
+
+
+def _get_bounded_clusters(points, indices, leader_radius, radius_threshold):
+    clusters = []
+    for members in _get_leader_clusters(points[indices], leader_radius):
+        members = indices[members]
+        if _get_cluster_radius(points[members]) <= radius_threshold:
+            clusters.append(members)
+        else:
+            clusters.extend(_get_bounded_clusters(points, members, leader_radius/2.0, radius_threshold))
+    return clusters
+
+
+def _get_leader_clusters(points, radius):
+    """
+    Each point joins the closest leader within radius, or becomes a new leader.
+    Leaders are looked up in the neighboring cells of a grid whose cells are radius wide.
+
+    :param np.ndarray points:
+    :param float radius:
+    :return list: list of index arrays
+    """
+    grid = {}
+    leaders = []
+    members = []
+    for idx, point in enumerate(points):
+        cell = tuple(np.floor(point/radius).astype(int))
+        best_leader, best_distance = None, radius
+        for neighbor in itertools.product(range(cell[0]-1, cell[0]+2), range(cell[1]-1, cell[1]+2)):
+            for leader in grid.get(neighbor, []):
+                distance = np.linalg.norm(points[leaders[leader]] - point)
+                if distance <= best_distance:
+                    best_leader, best_distance = leader, distance
+        if best_leader is None:
+            best_leader = len(leaders)
+            leaders.append(idx)
+            members.append([])
+            grid.setdefault(cell, []).append(best_leader)
+        members[best_leader].append(idx)
+    return [np.array(each) for each in members]
+
+
+def _merge_clusters(points, clusters, radius_threshold):
+    """
+    Greedily merges pairs of clusters whose centers are within 2*radius_threshold, closest pairs first,
+    as long as the merged cluster's radius is at most radius_threshold.
+
+    :param np.ndarray points:
+    :param list clusters:
+    :param float radius_threshold:
+    :return list:
+    """
+    centers = [points[members].mean(0) for members in clusters]
+    cell_size = 2*radius_threshold
+    grid = {}
+    for idx, center in enumerate(centers):
+        grid.setdefault(tuple(np.floor(center/cell_size).astype(int)), []).append(idx)
+    pairs = []
+    for idx, center in enumerate(centers):
+        cell = tuple(np.floor(center/cell_size).astype(int))
+        for neighbor in itertools.product(range(cell[0]-1, cell[0]+2), range(cell[1]-1, cell[1]+2)):
+            for other_idx in grid.get(neighbor, []):
+                distance = np.linalg.norm(centers[other_idx] - center)
+                if idx < other_idx and distance <= cell_size:
+                    pairs.append((distance, idx, other_idx))
+
+    parents = range(len(clusters))
+    merged = {idx: members for idx, members in enumerate(clusters)}
+    for _, idx, other_idx in sorted(pairs):
+        root, other_root = _find_root(parents, idx), _find_root(parents, other_idx)
+        if root == other_root:
+            continue
+        members = np.concatenate([merged[root], merged[other_root]])
+        if _get_cluster_radius(points[members]) <= radius_threshold:
+            parents[other_root] = root
+            merged[root] = members
+            del merged[other_root]
+    return [merged[idx] for idx in sorted(merged)]
+
+
+def _find_root(parents, idx):
+    while parents[idx] != idx:
+        parents[idx] = parents[parents[idx]]
+        idx = parents[idx]
+    return idx
+
+
+def _get_cluster_radius(points):
+    return np.sqrt(np.max(np.sum((points - points.mean(0))**2, 1)))
 
 
 def _get_circles(primitive_parse, intersection_points):
@@ -115,11 +263,17 @@ def _get_circles(primitive_parse, intersection_points):
     """
     eps = params.CIRCLE_EPS
     circle_dict = {}
-    for point_key, point in intersection_points.iteritems():
+    circles = primitive_parse.circles.values()
+    point_keys = intersection_points.keys()
+    if len(circles) == 0 or len(point_keys) == 0:
+        return circle_dict
+    distances = distances_between_points([intersection_points[key] for key in point_keys],
+                                         [circle.center for circle in circles])
+    for point_idx, point_key in enumerate(point_keys):
         d = {}
         radius_key = 0
-        for circle in primitive_parse.circles.values():
-            if distance_between_points(point, circle.center) <= eps:
+        for circle_idx, circle in enumerate(circles):
+            if distances[point_idx, circle_idx] <= eps:
                 d[radius_key] = circle
                 radius_key += 1
         if len(d) > 0:
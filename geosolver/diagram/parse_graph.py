@@ -1,7 +1,8 @@
 import itertools
-from geosolver.diagram.computational_geometry import distance_between_points, distance_between_line_and_point, \
-    distance_between_circle_and_point, distance_between_arc_and_point
+from geosolver.diagram.computational_geometry import distances_between_lines_and_points, \
+    distances_between_circles_and_points, distances_between_arcs_and_points
 from geosolver.diagram.instance_exists import instance_exists
+from geosolver.diagram.stage_stats import start_stage, end_stage
 from geosolver.diagram.states import CoreParse, GraphParse
 import networkx as nx
 from geosolver.ontology.instantiator_definitions import instantiators
@@ -12,6 +13,7 @@ __author__ = 'minjoon'
 
 
 def parse_graph(core_parse):
+    start_time = start_stage()
     assert isinstance(core_parse, CoreParse)
     circle_dict = _get_circle_dict(core_parse)
     line_graph = _get_line_graph(core_parse)
@@ -24,6 +26,8 @@ def parse_graph(core_parse):
             arc_graphs[(center_key, radius_key)] = _get_arc_graph(core_parse, circle, circle_variable, points)
 
     graph_parse = GraphParse(core_parse, line_graph, circle_dict, arc_graphs)
+    end_stage('parse_graph', graph_parse, start_time, num_line_edges=line_graph.number_of_edges(),
+              num_arc_edges=sum(arc_graph.number_of_edges() for arc_graph in arc_graphs.values()))
     return graph_parse
 
 
@@ -41,18 +45,19 @@ def _get_circle_dict(core_parse):
     circle_dict = {}
 
 
+    point_keys = core_parse.intersection_points.keys()
+    point_list = [core_parse.intersection_points[key] for key in point_keys]
     for point_key, dd in core_parse.circles.iteritems():
         d = {}
-        for radius_key, circle in dd.iteritems():
+        radius_keys = dd.keys()
+        distances = distances_between_circles_and_points([dd[radius_key] for radius_key in radius_keys], point_list)
+        for radius_idx, radius_key in enumerate(radius_keys):
+            circle = dd[radius_key]
             points = {}
-            for key in core_parse.intersection_points:
-                point = core_parse.intersection_points[key]
-                if distance_between_circle_and_point(circle, point) <= eps:
-                    points[key] = point
-            center_var = core_parse.point_variables[point_key]
-            radius_var = core_parse.radius_variables[point_key][radius_key]
-            circle_var = FormulaNode(function_signatures['Circle'], [center_var, radius_var])
-            d[radius_key] = {'instance': circle, 'points': points, 'variable': circle_var}
+            for idx, key in enumerate(point_keys):
+                if distances[radius_idx, idx] <= eps:
+                    points[key] = point_list[idx]
+            d[radius_key] = _get_circle_entry(core_parse, point_key, radius_key, points)
         if len(d) > 0:
             circle_dict[point_key] = d
     return circle_dict
@@ -71,18 +76,23 @@ def _get_line_graph(core_parse):
     eps = LINE_EPS
     line_graph = nx.Graph()
 
-    for key0, key1 in itertools.combinations(core_parse.intersection_points, 2):
-        p0, p1 = core_parse.intersection_points[key0], core_parse.intersection_points[key1]
-        line = instantiators['line'](p0, p1)
-        v0, v1 = core_parse.point_variables[key0], core_parse.point_variables[key1]
-        var = FormulaNode(function_signatures['Line'], [v0, v1])
+    point_keys = core_parse.intersection_points.keys()
+    point_list = [core_parse.intersection_points[key] for key in point_keys]
+    key_pairs = list(itertools.combinations(point_keys, 2))
+    lines = [instantiators['line'](core_parse.intersection_points[key0], core_parse.intersection_points[key1])
+             for key0, key1 in key_pairs]
+    if len(lines) == 0:
+        return line_graph
+    distances = distances_between_lines_and_points(lines, point_list)
+
+    for line_idx, (key0, key1) in enumerate(key_pairs):
+        line = lines[line_idx]
         if instance_exists(core_parse, line):
             points = {}
-            for key in set(core_parse.intersection_points).difference({key0, key1}):
-                point = core_parse.intersection_points[key]
-                if distance_between_line_and_point(line, point) <= eps:
-                    points[key] = point
-            line_graph.add_edge(key0, key1, instance=line, points=points, variable=var)
+            for idx, key in enumerate(point_keys):
+                if key not in (key0, key1) and distances[line_idx, idx] <= eps:
+                    points[key] = point_list[idx]
+            _add_line_edge(line_graph, core_parse, key0, key1, points)
     return line_graph
 
 
@@ -96,18 +106,45 @@ def _get_arc_graph(core_parse, circle, circle_variable, circle_points):
     """
     eps = CIRCLE_EPS
     arc_graph = nx.DiGraph()
-    for key0, key1 in itertools.permutations(circle_points, 2):
-        p0, p1 = circle_points[key0], circle_points[key1]
-        arc = instantiators['arc'](circle, p0, p1)
-        v0, v1 = core_parse.point_variables[key0], core_parse.point_variables[key1]
-        var = FormulaNode(function_signatures['Arc'], [circle_variable, v0, v1])
+
+    point_keys = circle_points.keys()
+    point_list = [circle_points[key] for key in point_keys]
+    key_pairs = list(itertools.permutations(point_keys, 2))
+    arcs = [instantiators['arc'](circle, circle_points[key0], circle_points[key1]) for key0, key1 in key_pairs]
+    if len(arcs) == 0:
+        return arc_graph
+    distances = distances_between_arcs_and_points(arcs, point_list)
+
+    for arc_idx, (key0, key1) in enumerate(key_pairs):
+        arc = arcs[arc_idx]
         if instance_exists(core_parse, arc):
             arc_points = {}
-            for key in set(circle_points).difference({key0, key1}):
-                point = circle_points[key]
-                if distance_between_arc_and_point(arc, point) <= eps:
-                    arc_points[key] = point
-            arc_graph.add_edge(key0, key1, instance=arc, points=arc_points, variable=var)
+            for idx, key in enumerate(point_keys):
+                if key not in (key0, key1) and distances[arc_idx, idx] <= eps:
+                    arc_points[key] = point_list[idx]
+            _add_arc_edge(arc_graph, core_parse, circle, circle_variable, key0, key1, arc_points)
     return arc_graph
 
 
+def _get_circle_entry(core_parse, center_key, radius_key, points):
+    circle = core_parse.circles[center_key][radius_key]
+    center_var = core_parse.point_variables[center_key]
+    radius_var = core_parse.radius_variables[center_key][radius_key]
+    circle_var = FormulaNode(function_signatures['Circle'], [center_var, radius_var])
+    return {'instance': circle, 'points': points, 'variable': circle_var}
+
+
+def _add_line_edge(line_graph, core_parse, key0, key1, points):
+    line = instantiators['line'](core_parse.intersection_points[key0], core_parse.intersection_points[key1])
+    v0, v1 = core_parse.point_variables[key0], core_parse.point_variables[key1]
+    var = FormulaNode(function_signatures['Line'], [v0, v1])
+    line_graph.add_edge(key0, key1, instance=line, points=points, variable=var)
+
+
+def _add_arc_edge(arc_graph, core_parse, circle, circle_variable, key0, key1, points):
+    arc = instantiators['arc'](circle, core_parse.intersection_points[key0], core_parse.intersection_points[key1])
+    v0, v1 = core_parse.point_variables[key0], core_parse.point_variables[key1]
+    var = FormulaNode(function_signatures['Arc'], [circle_variable, v0, v1])
+    arc_graph.add_edge(key0, key1, instance=arc, points=points, variable=var)
+
+
@@ -2,13 +2,14 @@ from scipy import ndimage
 import cv2
 import numpy as np
 
+from geosolver.diagram.stage_stats import start_stage, end_stage
 from geosolver.diagram.states import ImageSegment, ImageSegmentParse
-from geosolver.ontology.instantiator_definitions import instantiators
 
 __author__ = 'minjoon'
 
 
 def parse_image_segments(image):
+    start_time = start_stage()
     kernel = np.ones((3,3), np.uint8)
     block_size = 13
     c = 20
@@ -19,6 +20,9 @@ def parse_image_segments(image):
     image_segments = _get_image_segments(image, kernel, block_size, c)
     diagram_segment, label_segments = _get_diagram_and_label_segments(image_segments, min_area, min_height, min_width)
     image_segment_parse = ImageSegmentParse(image, diagram_segment, label_segments)
+    end_stage('parse_image_segments', image_segment_parse, start_time,
+              num_segments=len(image_segments), num_label_segments=len(label_segments),
+              num_pixels=len(diagram_segment.pixels))
     return image_segment_parse
 
 
@@ -31,15 +35,7 @@ def _get_image_segments(image, kernel, block_size, c):
 
     image_segments = {}
     for idx, slice_ in enumerate(slices):
-        offset = instantiators['point'](slice_[1].start, slice_[0].start)
-        sliced_image = image[slice_]
-        boolean_array = labeled[slice_] == (idx+1)
-        segmented_image = 255- (255-sliced_image) * boolean_array
-        pixels = set(instantiators['point'](x, y) for x, y in np.transpose(np.nonzero(np.transpose(boolean_array))))
-        binarized_segmented_image = cv2.adaptiveThreshold(segmented_image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                                          cv2.THRESH_BINARY_INV, block_size, c)
-
-        image_segment = ImageSegment(segmented_image, sliced_image, binarized_segmented_image, pixels, offset, idx)
+        image_segment = ImageSegment(image, labeled, slice_, idx+1, idx, block_size, c)
         image_segments[idx] = image_segment
 
     return image_segments
@@ -1,8 +1,11 @@
+import logging
+
 import cv2
 import numpy as np
 
+from geosolver.diagram.stage_stats import start_stage, end_stage
 from geosolver.diagram.states import ImageSegmentParse, PrimitiveParse
-from geosolver.diagram.computational_geometry import dot_distance_between_points
+from geosolver.diagram.pixel_coverage import get_pixel_array, get_line_masks
 from geosolver.ontology.instantiator_definitions import instantiators
 from geosolver.parameters import hough_line_parameters as line_params
 from geosolver.parameters import hough_circle_parameters as circle_params
@@ -11,18 +14,35 @@ from geosolver.utils.num import dimension_wise_non_maximum_suppression
 __author__ = 'minjoon'
 
 def parse_primitives(image_segment_parse):
+    start_time = start_stage()
     assert isinstance(image_segment_parse, ImageSegmentParse)
     diagram_segment = image_segment_parse.diagram_image_segment
-    lines = _get_lines(diagram_segment, line_params)
+    line_stats = {}
+    lines = _get_lines(diagram_segment, line_params, line_stats)
     circles = _get_circles(diagram_segment, circle_params)
     line_dict = {idx: line for idx, line in enumerate(lines)}
     circle_dict = {idx+len(lines): circle for idx, circle in enumerate(circles)}
     primitive_parse = PrimitiveParse(image_segment_parse, line_dict, circle_dict)
+    end_stage('parse_primitives', primitive_parse, start_time, num_lines=len(lines), num_circles=len(circles),
+              **line_stats)
     return primitive_parse
 
 
-def _get_lines(image_segment, params):
+def _get_lines(image_segment, params, stats=None):
+    """
+    Segments the Hough lines that survive non-maximum suppression,
+    and keeps at most params.max_num_segments segments with the largest pixel support (all if it is None).
+    If stats is given, the number of candidates at each step is stored in it.
+
+    :param image_segment:
+    :param params:
+    :param dict stats:
+    :return list:
+    """
+    if stats is None:
+        stats = {}
     lines = []
+    stats.update(num_hough_lines=0, num_nms_lines=0, num_line_segments=0)
     temp = cv2.HoughLines(image_segment.binarized_segmented_image, params.rho, params.theta, params.threshold)
     if temp is None:
         return lines
@@ -31,17 +51,42 @@ def _get_lines(image_segment, params):
     if len(rho_theta_pairs) > params.max_num:
         rho_theta_pairs = rho_theta_pairs[:params.max_num]
 
-
     nms_rho_theta_pairs = dimension_wise_non_maximum_suppression(rho_theta_pairs, (params.nms_rho, params.nms_theta),
                                                                  _dimension_wise_distances_between_rho_theta_pairs)
 
-    for rho_theta_pair in rho_theta_pairs:
-        curr_lines = _segment_line(image_segment, rho_theta_pair, params)
+    pixel_array = get_pixel_array(image_segment.pixels)
+    residuals = _get_rho_theta_residuals(pixel_array, nms_rho_theta_pairs)
+    for idx, rho_theta_pair in enumerate(nms_rho_theta_pairs):
+        near_pixel_array = pixel_array[residuals[:, idx] <= params.eps]
+        curr_lines = _segment_line(near_pixel_array, rho_theta_pair, params)
         lines.extend(curr_lines)
 
+    num_segments = len(lines)
+    lines = _get_best_supported_lines(pixel_array, lines, params.eps, params.max_num_segments)
+    stats.update(num_hough_lines=len(rho_theta_pairs), num_nms_lines=len(nms_rho_theta_pairs),
+                 num_line_segments=num_segments)
+    logging.info("Line candidates: %d Hough lines, %d after non-maximum suppression, %d segments, %d kept." %
+                 (len(rho_theta_pairs), len(nms_rho_theta_pairs), num_segments, len(lines)))
     return lines
 
 
+def _get_best_supported_lines(pixel_array, lines, eps, max_num):
+    """
+    Keeps max_num lines with the largest number of pixels within eps, in their original order.
+
+    :param np.ndarray pixel_array:
+    :param list lines:
+    :param float eps:
+    :param int max_num:
+    :return list:
+    """
+    if max_num is None or len(lines) <= max_num:
+        return lines
+    supports = np.count_nonzero(get_line_masks(pixel_array, lines, eps), 1)
+    indices = sorted(np.argsort(-supports, kind='mergesort')[:max_num])
+    return [lines[idx] for idx in indices]
+
+
 def _get_circles(image_segment, params):
 
     temp = cv2.HoughCircles(image_segment.segmented_image, cv2.HOUGH_GRADIENT, params.dp, params.minDist,
@@ -59,50 +104,57 @@ def _get_circles(image_segment, params):
     return circles
 
 
-def _segment_line(image_segment, rho_theta_pair, params):
+def _segment_line(near_pixel_array, rho_theta_pair, params):
+    """
+    Splits the pixels near the rho-theta line into segments wherever two consecutive pixels along the line
+    are more than max_gap apart, and keeps the segments longer than min_length.
+    As before, a segment ends at the pixel preceding a gap (or the second last pixel),
+    and the pixel right after that point is skipped before the next segment starts.
+
+    :param np.ndarray near_pixel_array: (N, 2) array of (x, y) of the pixels near the line
+    :param rho_theta_pair:
+    :param params:
+    :return list:
+    """
     lines = []
-    near_pixels = _get_pixels_near_rho_theta_pair(image_segment.pixels, rho_theta_pair, params.eps)
-    if len(near_pixels) == 0:
+    if len(near_pixel_array) == 0:
         return lines
 
-    reference_pixel = near_pixels[0]
-    distances = [dot_distance_between_points(_rho_theta_pair_unit_vector(rho_theta_pair), p, reference_pixel)
-                 for p in near_pixels]
+    unit_vector = _rho_theta_pair_unit_vector(rho_theta_pair)
+    differences = near_pixel_array - near_pixel_array[0]
+    distances = differences[:, 0]*unit_vector[0] + differences[:, 1]*unit_vector[1]
     order = np.argsort(distances)
-    start_idx = None
-    end_idx = None
-
-    for order_idx, idx in enumerate(order):
-        if start_idx is None:
-            start_idx = idx
-            end_idx = idx
-        else:
-            d0 = distances[idx]
-            d1 = distances[order[order_idx-1]]
-            if abs(d0-d1) > params.max_gap or order_idx == len(order) - 1:
-                length = abs(distances[start_idx] - distances[end_idx])
-                if length > params.min_length:
-                    p0 = near_pixels[start_idx]
-                    p1 = near_pixels[end_idx]
-                    line = instantiators['line'](p0, p1)
-                    lines.append(line)
-                start_idx = None
-            else:
-                end_idx = idx
+    sorted_distances = distances[order]
+    ends = np.append(np.flatnonzero(np.abs(np.diff(sorted_distances)) > params.max_gap) + 1, len(order) - 1)
+
+    start = 0
+    while start < len(order) - 1:
+        end = ends[np.searchsorted(ends, start, side='right')]
+        length = abs(sorted_distances[start] - sorted_distances[end-1])
+        if length > params.min_length:
+            p0 = instantiators['point'](*near_pixel_array[order[start]].tolist())
+            p1 = instantiators['point'](*near_pixel_array[order[end-1]].tolist())
+            line = instantiators['line'](p0, p1)
+            lines.append(line)
+        start = end + 1
 
     return lines
 
 
-def _get_pixels_near_rho_theta_pair(pixels, rho_theta_pair, eps):
-    near_pixels = [pixel for pixel in pixels
-                   if _distance_between_rho_theta_pair_and_point(rho_theta_pair, pixel) <= eps]
-    return near_pixels
-
-
-def _distance_between_rho_theta_pair_and_point(rho_theta_pair, point):
-    rho, theta = rho_theta_pair
-    x, y = point
-    return abs(rho - x*np.cos(theta) - y*np.sin(theta))
+def _get_rho_theta_residuals(pixel_array, rho_theta_pairs):
+    """
+    Distances between every pixel and every rho-theta line, i.e. abs(rho - x*cos(theta) - y*sin(theta)).
+
+    :param np.ndarray pixel_array: (N, 2) array of (x, y)
+    :param list rho_theta_pairs: list of K (rho, theta) pairs
+    :return np.ndarray: (N, K) array
+    """
+    if len(rho_theta_pairs) == 0 or len(pixel_array) == 0:
+        return np.zeros((len(pixel_array), len(rho_theta_pairs)))
+    rhos, thetas = np.transpose(rho_theta_pairs)
+    x = pixel_array[:, 0, np.newaxis]
+    y = pixel_array[:, 1, np.newaxis]
+    return np.abs(rhos - x*np.cos(thetas) - y*np.sin(thetas))
 
 
 def _rho_theta_pair_unit_vector(rho_theta_pair):
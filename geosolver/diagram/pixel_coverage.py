@@ -0,0 +1,90 @@
+"""
+NumPy-backed pixel coverage of primitives.
+Pixels are stored as an (N, 2) array of (x, y) coordinates, and each primitive's coverage
+is a boolean mask of length N over that array.
+All masks of the same kind are computed in one batched pass over the pixels.
+"""
+import numpy as np
+
+from geosolver.diagram.computational_geometry import distances_between_lines_and_points, \
+    distances_between_circles_and_points
+from geosolver.ontology.instantiator_arrays import PointArray
+
+__author__ = 'minjoon'
+
+
+def get_pixel_array(pixels):
+    """
+    Converts an iterable of points into an (N, 2) array of (x, y) coordinates.
+
+    :param pixels: iterable of points, PointArray, or (N, 2) array
+    :return np.ndarray:
+    """
+    if isinstance(pixels, np.ndarray):
+        return pixels
+    if isinstance(pixels, PointArray):
+        return pixels.array
+    array = np.array([(pixel.x, pixel.y) for pixel in pixels])
+    if len(array) == 0:
+        return np.zeros((0, 2), dtype=int)
+    return array
+
+
+def get_line_masks(pixel_array, lines, eps):
+    """
+    Boolean masks of shape (len(lines), N).
+    A pixel is covered by a line if it is within eps of the line segment.
+
+    :param np.ndarray pixel_array:
+    :param list lines:
+    :param float eps:
+    :return np.ndarray:
+    """
+    if len(lines) == 0:
+        return np.zeros((0, len(pixel_array)), dtype=bool)
+    return distances_between_lines_and_points(lines, pixel_array) <= eps
+
+
+def get_point_masks(pixel_array, points, eps):
+    """
+    Boolean masks of shape (len(points), N).
+    A pixel is covered by a point if their distance is at most eps.
+
+    :param np.ndarray pixel_array:
+    :param points: list of points or (M, 2) array
+    :param float eps:
+    :return np.ndarray:
+    """
+    if len(points) == 0:
+        return np.zeros((0, len(pixel_array)), dtype=bool)
+    points = np.array([(point[0], point[1]) for point in points], dtype=float)
+    dx = pixel_array[np.newaxis, :, 0] - points[:, np.newaxis, 0]
+    dy = pixel_array[np.newaxis, :, 1] - points[:, np.newaxis, 1]
+    return dx**2 + dy**2 <= eps**2
+
+
+def get_circle_masks(pixel_array, circles, eps):
+    """
+    Boolean masks of shape (len(circles), N).
+    A pixel is covered by a circle if its distance to the circumference is less than eps.
+
+    :param np.ndarray pixel_array:
+    :param list circles:
+    :param float eps:
+    :return np.ndarray:
+    """
+    if len(circles) == 0:
+        return np.zeros((0, len(pixel_array)), dtype=bool)
+    return distances_between_circles_and_points(circles, pixel_array) < eps
+
+
+def mask_union_size(masks):
+    """
+    Number of pixels covered by at least one of the masks.
+
+    :param list masks:
+    :return int:
+    """
+    if len(masks) == 0:
+        return 0
+    return int(np.count_nonzero(np.logical_or.reduce(masks)))
@@ -0,0 +1,113 @@
+"""
+Uniform grid index over the pixels of an image segment.
+Pixels are bucketed by grid cell once, so that queries along a line, arc or circle
+only touch the pixels in the cells of the corridor around the curve.
+Queries return candidate pixel indices; callers apply the exact distance test on those.
+"""
+import numpy as np
+
+from geosolver.diagram.computational_geometry import line_length, cartesian_angle, \
+    signed_distance_between_cartesian_angles
+
+__author__ = 'minjoon'
+
+
+class PixelGrid(object):
+    def __init__(self, pixel_array, cell_size=8):
+        """
+        :param np.ndarray pixel_array: (N, 2) array of (x, y)
+        :param int cell_size: width and height of each cell in pixels
+        :return:
+        """
+        self.pixel_array = pixel_array
+        self.cell_size = cell_size
+        if len(pixel_array) == 0:
+            cells = np.zeros((0, 2), dtype=int)
+        else:
+            cells = np.floor(pixel_array / float(cell_size)).astype(int)
+        self.num_cols = cells[:, 0].max() + 1 if len(cells) > 0 else 1
+        self.num_rows = cells[:, 1].max() + 1 if len(cells) > 0 else 1
+        cell_ids = cells[:, 1]*self.num_cols + cells[:, 0]
+        self.order = np.argsort(cell_ids, kind='mergesort')
+        sorted_ids = cell_ids[self.order]
+        all_ids = np.arange(self.num_cols*self.num_rows)
+        self.starts = np.searchsorted(sorted_ids, all_ids, side='left')
+        self.ends = np.searchsorted(sorted_ids, all_ids, side='right')
+
+    def query_points(self, points, radius):
+        """
+        Indices of the pixels in the cells overlapping any of the squares of half-width radius around points.
+        This is a superset of the pixels within radius of any of the points.
+
+        :param np.ndarray points: (M, 2) array of (x, y)
+        :param float radius:
+        :return np.ndarray:
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(points) == 0:
+            return np.zeros(0, dtype=int)
+        low = np.floor((points - radius) / self.cell_size).astype(int)
+        high = np.floor((points + radius) / self.cell_size).astype(int)
+        low = np.maximum(low, 0)
+        high = np.minimum(high, [self.num_cols - 1, self.num_rows - 1])
+        span = int(max((high - low).max(), 0)) + 1
+        offsets = np.arange(span)
+        cols = low[:, 0, np.newaxis, np.newaxis] + offsets[np.newaxis, :, np.newaxis]
+        rows = low[:, 1, np.newaxis, np.newaxis] + offsets[np.newaxis, np.newaxis, :]
+        valid = (cols <= high[:, 0, np.newaxis, np.newaxis]) & (rows <= high[:, 1, np.newaxis, np.newaxis])
+        cell_ids = np.unique((rows*self.num_cols + cols)[valid])
+        return self._get_pixel_indices(cell_ids)
+
+    def query_line(self, line, radius):
+        """
+        Candidate indices of the pixels within radius of the line segment.
+
+        :param line:
+        :param float radius:
+        :return np.ndarray:
+        """
+        step = self.cell_size
+        num = int(np.ceil(line_length(line) / step)) + 1
+        t = np.linspace(0, 1, num)[:, np.newaxis]
+        points = (1 - t)*np.array([line.a.x, line.a.y]) + t*np.array([line.b.x, line.b.y])
+        return self.query_points(points, radius + step/2.0)
+
+    def query_arc(self, arc, radius):
+        """
+        Candidate indices of the pixels within radius of the arc (see distance_between_arc_and_point).
+
+        :param arc:
+        :param float radius:
+        :return np.ndarray:
+        """
+        circle = arc.circle
+        angle_a = cartesian_angle(circle.center, arc.a)
+        span = signed_distance_between_cartesian_angles(angle_a, cartesian_angle(circle.center, arc.b))
+        points = self._get_circle_points(circle, angle_a, span)
+        points = np.vstack([points, [[arc.a.x, arc.a.y], [arc.b.x, arc.b.y]]])
+        return self.query_points(points, radius + self.cell_size/2.0)
+
+    def query_circle(self, circle, radius):
+        """
+        Candidate indices of the pixels within radius of the circumference.
+
+        :param circle:
+        :param float radius:
+        :return np.ndarray:
+        """
+        points = self._get_circle_points(circle, 0, 2*np.pi)
+        return self.query_points(points, radius + self.cell_size/2.0)
+
+    def _get_circle_points(self, circle, start_angle, span):
+        num = int(np.ceil(span*circle.radius / self.cell_size)) + 1
+        angles = start_angle + np.linspace(0, span, num)
+        return np.column_stack([circle.center.x + circle.radius*np.cos(angles),
+                                circle.center.y + circle.radius*np.sin(angles)])
+
+    def _get_pixel_indices(self, cell_ids):
+        starts = self.starts[cell_ids]
+        ends = self.ends[cell_ids]
+        nonempty = ends > starts
+        if not np.any(nonempty):
+            return np.zeros(0, dtype=int)
+        return np.concatenate([self.order[start:end] for start, end in zip(starts[nonempty], ends[nonempty])])
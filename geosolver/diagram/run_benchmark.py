@@ -0,0 +1,227 @@
+"""
+Benchmarks of the diagram parsing on synthetic diagrams.
+benchmark_diagram_parser times every stage of diagram_to_graph_parse on synthetic diagrams of increasing density
+and on the reference images in images/, and reports the stage statistics (see stage_stats) and peak memory as JSON.
+Each case runs in a fresh process so that its peak memory is not shadowed by the previous cases.
+benchmark_get_instances (--instances on the command line) times angle and arc enumeration on grid diagrams.
+"""
+import argparse
+import itertools
+import json
+import logging
+from multiprocessing import Pool
+import os
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from geosolver.diagram import parse_primitives
+from geosolver.diagram.get_instances import _get_all_angles, _get_all_arcs, _get_angles, _get_arcs
+from geosolver.diagram.shortcuts import diagram_to_graph_parse
+from geosolver.diagram.stage_stats import set_stage_hook
+from geosolver.utils.prep import open_image
+
+__author__ = 'minjoon'
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'images')
+
+synthetic_cases = [
+    {'name': 'small', 'size': 300, 'num_lines': 3, 'num_circles': 1, 'num_labels': 3, 'noise': 0.0005},
+    {'name': 'medium', 'size': 500, 'num_lines': 6, 'num_circles': 2, 'num_labels': 6, 'noise': 0.001},
+    {'name': 'dense', 'size': 800, 'num_lines': 12, 'num_circles': 3, 'num_labels': 12, 'noise': 0.002},
+    {'name': 'very_dense', 'size': 1200, 'num_lines': 20, 'num_circles': 4, 'num_labels': 20, 'noise': 0.004},
+]
+
+fixed_cases = [
+    {'name': 'original', 'path': os.path.join(IMAGES_DIR, 'original.png')},
+    {'name': 'diagram', 'path': os.path.join(IMAGES_DIR, 'diagram.png')},
+]
+
+
+def render_synthetic_diagram(size, num_lines, num_circles, num_labels, noise, seed=0):
+    """
+    Grayscale diagram of random line segments and circles, letter labels, and salt noise.
+    Line segments join random points, circles have radii between 20 and size/4,
+    and noise is a fraction of the pixels set to black.
+
+    :param int size: width and height
+    :param int num_lines:
+    :param int num_circles:
+    :param int num_labels:
+    :param float noise: fraction of noise pixels
+    :param int seed:
+    :return np.ndarray:
+    """
+    random_state = np.random.RandomState(seed)
+    margin = size // 10
+    image = np.full((size, size), 255, dtype=np.uint8)
+    for _ in range(num_lines):
+        a, b = random_state.randint(margin, size - margin, (2, 2))
+        cv2.line(image, tuple(a), tuple(b), 0, 2)
+    for _ in range(num_circles):
+        radius = random_state.randint(20, max(21, size // 4))
+        center = random_state.randint(margin + radius, max(margin + radius + 1, size - margin - radius), 2)
+        cv2.circle(image, tuple(center), radius, 0, 2)
+    for idx in range(num_labels):
+        position = random_state.randint(margin // 2, size - margin // 2, 2)
+        cv2.putText(image, chr(ord('A') + idx % 26), tuple(position), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 0, 1)
+    num_noise = int(noise * size * size)
+    image[random_state.randint(0, size, num_noise), random_state.randint(0, size, num_noise)] = 0
+    return image
+
+
+def benchmark_diagram_parser(report_path=None, cases=None, max_num_segments=30):
+    """
+    Parses each case in a separate process and writes the report as JSON to report_path (stdout if None).
+    Each case is either a synthetic case (see render_synthetic_diagram) or a fixed case with 'path' to an image.
+    The report has, for each case, its parameters, the stats of each stage, the total time,
+    and the peak resident memory in kilobytes before and after parsing.
+
+    :param str report_path:
+    :param list cases: defaults to synthetic_cases + fixed_cases
+    :param int max_num_segments: budget of line candidates (see hough_line_parameters) used in each case
+    :return dict: report
+    """
+    if cases is None:
+        cases = synthetic_cases + fixed_cases
+    results = []
+    for case in cases:
+        pool = Pool(1)
+        try:
+            results.append(pool.apply(_benchmark_case, (case, max_num_segments)))
+        finally:
+            pool.close()
+            pool.join()
+    report = {'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'max_num_segments': max_num_segments,
+              'cases': results}
+    _write_report(report, report_path)
+    return report
+
+
+def _write_report(report, report_path):
+    if report_path is None:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        with open(report_path, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+
+
+def _benchmark_case(case, max_num_segments):
+    # Runs in its own process, so the parameters of the caller are not affected.
+    parse_primitives.line_params = parse_primitives.line_params._replace(max_num_segments=max_num_segments)
+    if 'path' in case:
+        diagram = open_image(case['path'])
+    else:
+        diagram = render_synthetic_diagram(case['size'], case['num_lines'], case['num_circles'],
+                                           case['num_labels'], case['noise'])
+    stages = {}
+    set_stage_hook(lambda stage_name, stats: stages.__setitem__(stage_name, stats))
+    base_rss = _get_peak_rss()
+    start = time.time()
+    try:
+        diagram_to_graph_parse(diagram)
+        error = None
+    except Exception as e:
+        error = repr(e)
+    total_time = time.time() - start
+    set_stage_hook(None)
+    return {'case': case, 'shape': list(diagram.shape), 'stages': stages, 'total_time': total_time,
+            'base_peak_rss_kb': base_rss, 'peak_rss_kb': _get_peak_rss(), 'error': error}
+
+
+def _get_peak_rss():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes on OS X, kilobytes on Linux
+        peak_rss //= 1024
+    return peak_rss
+
+
+def render_grid_diagram(num_lines, size=400, margin=40):
+    """
+    Grayscale diagram of num_lines horizontal and num_lines vertical lines,
+    and a circle centered at the central grid point passing through its neighbors.
+    Every pair of points on a common line is connected in the line graph, so the graph is dense.
+
+    :param int num_lines:
+    :param int size:
+    :param int margin:
+    :return np.ndarray:
+    """
+    image = np.full((size, size), 255, dtype=np.uint8)
+    coordinates = np.linspace(margin, size - margin, num_lines).astype(int)
+    for coordinate in coordinates:
+        cv2.line(image, (coordinate, margin), (coordinate, size - margin), 0, 2)
+        cv2.line(image, (margin, coordinate), (size - margin, coordinate), 0, 2)
+    center = coordinates[num_lines // 2]
+    radius = coordinates[1] - coordinates[0]
+    cv2.circle(image, (center, center), radius, 0, 2)
+    return image
+
+
+def _get_all_angles_by_permutations(graph_parse, is_variable, ignore_trivial=True):
+    items = []
+    for a_key, b_key, c_key in itertools.permutations(graph_parse.intersection_points, 3):
+        items.extend(_get_angles(graph_parse, is_variable, a_key, b_key, c_key, ignore_trivial=ignore_trivial).iteritems())
+    return dict(items)
+
+
+def _get_all_arcs_by_permutations(graph_parse, is_variable):
+    items = []
+    for a_key, b_key in itertools.permutations(graph_parse.intersection_points, 2):
+        items.extend(_get_arcs(graph_parse, is_variable, a_key, b_key).iteritems())
+    return dict(items)
+
+
+def _time(function, *args):
+    start = time.time()
+    out = function(*args)
+    return out, time.time() - start
+
+
+def benchmark_get_instances(report_path=None, nums_lines=(3, 4, 5, 6)):
+    """
+    Compares the adjacency-driven angle and arc enumeration against enumerating all permutations of points,
+    on grid diagrams (see render_grid_diagram), and writes the report as JSON to report_path (stdout if None).
+    The report has, for each grid, the sizes of its graph parse and, for angles and arcs,
+    the number of instances and the time of both enumerations.
+
+    :param str report_path:
+    :param tuple nums_lines: numbers of lines of the grids
+    :return dict: report
+    """
+    results = []
+    for num_lines in nums_lines:
+        graph_parse = diagram_to_graph_parse(render_grid_diagram(num_lines))
+        result = {'num_lines': num_lines, 'num_points': len(graph_parse.intersection_points),
+                  'num_line_edges': graph_parse.line_graph.number_of_edges(),
+                  'num_circles': len(graph_parse.arc_graphs)}
+        for name, function, reference_function in [('angle', _get_all_angles, _get_all_angles_by_permutations),
+                                                    ('arc', _get_all_arcs, _get_all_arcs_by_permutations)]:
+            instances, duration = _time(function, graph_parse, False)
+            reference_instances, reference_duration = _time(reference_function, graph_parse, False)
+            assert instances == reference_instances
+            result[name] = {'num_instances': len(instances), 'adjacency_time': duration,
+                            'permutations_time': reference_duration}
+        logging.info("%d x %d grid: %d angles, %d arcs" %
+                     (num_lines, num_lines, result['angle']['num_instances'], result['arc']['num_instances']))
+        results.append(result)
+    report = {'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'grids': results}
+    _write_report(report, report_path)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the diagram parser and writes a JSON report.")
+    parser.add_argument('--instances', action='store_true',
+                        help="benchmark angle and arc enumeration on grid diagrams instead")
+    parser.add_argument('--report', help="path of the JSON report (stdout by default)")
+    args = parser.parse_args()
+    if args.instances:
+        benchmark_get_instances(args.report)
+    else:
+        benchmark_diagram_parser(args.report)
@@ -1,11 +1,15 @@
+import heapq
 import logging
 
 import numpy as np
 
+from geosolver.diagram.stage_stats import start_stage, end_stage
 from geosolver.diagram.states import PrimitiveParse
-from geosolver.diagram.computational_geometry import line_length, circumference, \
-    distance_between_circle_and_point, midpoint, line_unit_vector, line_normal_vector, \
-    distance_between_points_squared, distance_between_line_and_point
+from geosolver.diagram.computational_geometry import circumference, distance_between_circle_and_point, \
+    distance_between_line_and_point, distances_between_lines_and_points, distances_between_circles_and_points
+from geosolver.diagram.distance_transform import line_support, circle_support
+from geosolver.diagram.pixel_coverage import get_pixel_array, get_line_masks, get_point_masks, get_circle_masks, \
+    mask_union_size
 from geosolver.ontology.instantiator_definitions import instantiators
 import geosolver.parameters as params
 
@@ -13,86 +17,293 @@ import geosolver.parameters as params
 __author__ = 'minjoon'
 
 
-def select_primitives(primitive_parse):
+def select_primitives(primitive_parse, lazy=False):
+    """
+    Greedily selects primitives that maximize the reward (see _evaluate_reward).
+    Rewards are evaluated incrementally (see _IncrementalReward), so each candidate costs
+    O(number of its pixels) per step instead of re-evaluating the whole selection.
+    If lazy is True, lazy-greedy selection with a priority queue is used instead.
+    It skips re-evaluating candidates whose stale gain cannot beat the current best,
+    which is exact as long as the reward is submodular (i.e. coherence has zero weight).
+    Candidates may be prefiltered before selection (see params.SELECTION_PREFILTER).
+
+    :param PrimitiveParse primitive_parse:
+    :param bool lazy:
+    :return PrimitiveParse:
+    """
+    start_time = start_stage()
     assert isinstance(primitive_parse, PrimitiveParse)
     if len(primitive_parse.primitives) == 0:
         logging.error("No primitive detected.")
-        return primitive_parse
-    pixels_dict = _get_pixels_dict(primitive_parse,
+        new_primitive_parse = _get_primitive_parse(primitive_parse.image_segment_parse, {})
+        end_stage('select_primitives', new_primitive_parse, start_time,
+                  num_candidates=0, num_selected=0, num_iterations=0, num_evaluations=0)
+        return new_primitive_parse
+    primitives = primitive_parse.primitives
+    if params.SELECTION_PREFILTER == 'distance_transform':
+        primitives = _get_supported_primitives(primitive_parse, params.DISTANCE_TRANSFORM_MIN_CANDIDATE_SUPPORT)
+    pixels_dict = _get_pixels_dict(primitive_parse.image_segment_parse.diagram_image_segment.pixels, primitives,
                                    params.LINE_EPS, params.CIRCLE_EPS)
-    selected_primitives = {}
-    remaining_primitives = primitive_parse.primitives.copy()
-    reward = 0
-    while len(remaining_primitives) > 0:
-        key = _get_next_primitive_key(selected_primitives, remaining_primitives, pixels_dict)
-        updated_selected_primitives = selected_primitives.copy()
-        updated_selected_primitives[key] = remaining_primitives[key]
-        new_reward = _evaluate_reward(updated_selected_primitives, pixels_dict)
-        if new_reward - reward > params.PRIMITIVE_SELECTION_MIN_GAIN:
-            selected_primitives = updated_selected_primitives
-            del remaining_primitives[key]
-            reward = new_reward
-        else:
-            break
+    incremental_reward = _IncrementalReward(primitives, pixels_dict)
+    if lazy:
+        selected_primitives, num_iterations = _select_lazy_greedy(incremental_reward)
+    else:
+        selected_primitives, num_iterations = _select_greedy(incremental_reward)
 
     new_primitive_parse = _get_primitive_parse(primitive_parse.image_segment_parse, selected_primitives)
+    end_stage('select_primitives', new_primitive_parse, start_time,
+              num_candidates=len(primitives), num_selected=len(selected_primitives),
+              num_iterations=num_iterations, num_evaluations=incremental_reward.num_evaluations)
     return new_primitive_parse
 
-def _get_primitive_parse(segment_parse, primitives):
-    lines = dict(pair for pair in primitives.iteritems()
-                 if isinstance(pair[1], instantiators['line']))
-    circles = dict(pair for pair in primitives.iteritems()
-                   if isinstance(pair[1], instantiators['circle']))
-    return PrimitiveParse(segment_parse, lines, circles)
 
+def _get_supported_primitives(primitive_parse, min_support):
+    """
+    Primitives whose distance transform support is at least min_support.
 
-def _get_next_primitive_key(selected_primitives, remaining_primitives, pixels_dict):
-    return max(remaining_primitives.items(),
-               key=lambda p: _evaluate_reward(dict(selected_primitives.items()+[p]), pixels_dict))[0]
+    :param PrimitiveParse primitive_parse:
+    :param float min_support:
+    :return dict:
+    """
+    distance_transform = primitive_parse.image_segment_parse.diagram_image_segment.distance_transform
+    primitives = {}
+    for key, primitive in primitive_parse.primitives.iteritems():
+        if isinstance(primitive, instantiators['line']):
+            support = line_support(distance_transform, primitive, params.LINE_EPS)
+        else:
+            support = circle_support(distance_transform, primitive, params.CIRCLE_EPS)
+        if support >= min_support:
+            primitives[key] = primitive
+    return primitives
 
 
-def _get_pixels_dict(primitive_parse, line_eps, circle_eps):
-    primitives = primitive_parse.primitives
-    pixels = primitive_parse.image_segment_parse.diagram_image_segment.pixels
-    pixels_dict = {'all': pixels}
-    for key, primitive in primitives.iteritems():
+def _select_greedy(incremental_reward):
+    """
+    :return tuple: selected primitives and the number of iterations
+    """
+    num_iterations = 0
+    remaining_keys = list(incremental_reward.primitives)
+    while len(remaining_keys) > 0:
+        num_iterations += 1
+        key, new_reward = max(((key, incremental_reward.evaluate(key)) for key in remaining_keys),
+                              key=lambda pair: pair[1])
+        if new_reward - incremental_reward.reward > params.PRIMITIVE_SELECTION_MIN_GAIN:
+            incremental_reward.add(key)
+            remaining_keys.remove(key)
+        else:
+            break
+    return incremental_reward.selected, num_iterations
+
+
+def _select_lazy_greedy(incremental_reward):
+    """
+    The popped candidate is re-evaluated and accepted only if its fresh gain still ranks first
+    against the stale gains left in the heap (upper bounds when the reward is submodular).
+    Ties are broken by the order of the candidates, as in _select_greedy,
+    so both select the same primitives.
+
+    :return tuple: selected primitives and the number of iterations (pops from the heap)
+    """
+    num_iterations = 0
+    reward = incremental_reward.reward
+    heap = [(-(incremental_reward.evaluate(key) - reward), order, key)
+            for order, key in enumerate(incremental_reward.primitives)]
+    heapq.heapify(heap)
+    while len(heap) > 0:
+        num_iterations += 1
+        _, order, key = heapq.heappop(heap)
+        gain = incremental_reward.evaluate(key) - incremental_reward.reward
+        entry = (-gain, order, key)
+        if len(heap) > 0 and heap[0] < entry:
+            heapq.heappush(heap, entry)
+            continue
+        if gain > params.PRIMITIVE_SELECTION_MIN_GAIN:
+            incremental_reward.add(key)
+        else:
+            break
+    return incremental_reward.selected, num_iterations
+
+
+class _IncrementalReward(object):
+    """
+    Keeps the terms of _evaluate_reward for the current selection, so that the reward
+    of the selection plus one candidate can be computed without starting from scratch.
+    Covered pixels and covered end pixels are kept as bitmaps over the pixel array,
+    and coherence is kept as the minimum distance from each selected primitive's anchor points
+    (end points of a line, center of a circle) to the selection.
+    """
+    def __init__(self, primitives, pixels_dict):
+        self.primitives = primitives
+        self.selected = {}
+        self.reward = 0
+        self.num_evaluations = 0
+
+        num_pixels = len(pixels_dict['all'])
+        self.indices = {key: np.flatnonzero(pixels_dict[key]) for key in primitives}
+        self.end_indices = {key: np.flatnonzero(pixels_dict[primitive.a] | pixels_dict[primitive.b])
+                            for key, primitive in primitives.iteritems()
+                            if isinstance(primitive, instantiators['line'])}
+        self.covered = np.zeros(num_pixels, dtype=bool)
+        self.end_covered = np.zeros(num_pixels, dtype=bool)
+        self.coverage = 0
+        self.pixel_num = 0
+        self.end_pixel_num = 0
+        self.min_distances = {}
+        self.distances = _get_anchor_distances(primitives)
+
+    def evaluate(self, key):
+        """
+        Reward of the current selection with the primitive of key added.
+        Equal to _evaluate_reward on the same primitives.
+
+        :param key:
+        :return float:
+        """
+        self.num_evaluations += 1
+        indices = self.indices[key]
+        coverage = self.coverage + np.count_nonzero(~self.covered[indices])
+        pixel_num = self.pixel_num + len(indices)
+        end_pixel_num = self.end_pixel_num
+        if key in self.end_indices:
+            end_pixel_num += np.count_nonzero(~self.end_covered[self.end_indices[key]])
+
+        partial_primitives = dict(self.selected.items() + [(key, self.primitives[key])])
+        length_sum = _length_sum(partial_primitives)
+        scores = []
+        for idx in partial_primitives:
+            if idx == key:
+                min_distances = [min(self._distance(key, anchor_idx, other_idx) for other_idx in partial_primitives)
+                                 for anchor_idx in range(len(self._anchors(key)))]
+            else:
+                min_distances = [min(distance, self._distance(idx, anchor_idx, key))
+                                 for anchor_idx, distance in enumerate(self.min_distances[idx])]
+            scores.append(_distance_score(np.mean(min_distances)))
+        coherence = np.mean(scores)
+
+        return _reward([coverage, pixel_num, length_sum, coherence, end_pixel_num])
+
+    def add(self, key):
+        new_reward = self.evaluate(key)
+        indices = self.indices[key]
+        self.coverage += np.count_nonzero(~self.covered[indices])
+        self.covered[indices] = True
+        self.pixel_num += len(indices)
+        if key in self.end_indices:
+            end_indices = self.end_indices[key]
+            self.end_pixel_num += np.count_nonzero(~self.end_covered[end_indices])
+            self.end_covered[end_indices] = True
+
+        for idx, min_distances in self.min_distances.iteritems():
+            self.min_distances[idx] = [min(distance, self._distance(idx, anchor_idx, key))
+                                       for anchor_idx, distance in enumerate(min_distances)]
+        self.selected[key] = self.primitives[key]
+        self.min_distances[key] = [min(self._distance(key, anchor_idx, other_idx) for other_idx in self.selected)
+                                   for anchor_idx in range(len(self._anchors(key)))]
+        self.reward = new_reward
+
+    def _anchors(self, key):
+        primitive = self.primitives[key]
         if isinstance(primitive, instantiators['line']):
-            eps = line_eps
-            curr_pixels = _get_pixels_near_line(pixels, primitive, eps)
-            pixels_dict[key] = curr_pixels
-
-            """
-            image = cv2.cvtColor(primitive_parse.image_segment_parse.diagram_image_segment.segmented_image, cv2.COLOR_GRAY2BGR)
-            draw_line(image, primitive)
-            display_image(image)
-            for pixel in curr_pixels:
-                draw_point(image, pixel)
-            display_image(image)
-            """
-
-            a_pixels = _get_pixels_near_point(pixels, primitive.a, eps)
-            b_pixels = _get_pixels_near_point(pixels, primitive.b, eps)
-            pixels_dict[primitive.a] = a_pixels
-            pixels_dict[primitive.b] = b_pixels
+            return [primitive.a, primitive.b]
+        elif isinstance(primitive, instantiators['circle']):
+            return [primitive.center]
 
+    def _distance(self, key, anchor_idx, other_key):
+        return self.distances[(key, anchor_idx, other_key)]
+
+
+def _get_anchor_distances(primitives):
+    """
+    Distances from every anchor point (end points of each line, center of each circle)
+    to every primitive, keyed by (key, anchor_idx, other_key).
+    Computed with one batched call per primitive type.
+
+    :param dict primitives:
+    :return dict:
+    """
+    anchors = []
+    for key, primitive in primitives.iteritems():
+        if isinstance(primitive, instantiators['line']):
+            anchors.extend([(key, 0, primitive.a), (key, 1, primitive.b)])
         elif isinstance(primitive, instantiators['circle']):
-            eps = circle_eps
-            curr_pixels = set(pixel for pixel in pixels if distance_between_circle_and_point(primitive, pixel) < eps)
-            pixels_dict[key] = curr_pixels
-    return pixels_dict
+            anchors.append((key, 0, primitive.center))
+    anchor_points = [point for _, _, point in anchors]
+    line_keys = [key for key, primitive in primitives.iteritems() if isinstance(primitive, instantiators['line'])]
+    circle_keys = [key for key, primitive in primitives.iteritems() if isinstance(primitive, instantiators['circle'])]
+
+    distances = {}
+    for other_keys, batch_function in [(line_keys, distances_between_lines_and_points),
+                                       (circle_keys, distances_between_circles_and_points)]:
+        if len(other_keys) == 0:
+            continue
+        matrix = batch_function([primitives[key] for key in other_keys], anchor_points)
+        for other_idx, other_key in enumerate(other_keys):
+            for anchor_idx, (key, point_idx, _) in enumerate(anchors):
+                distances[(key, point_idx, other_key)] = matrix[other_idx, anchor_idx]
+    return distances
 
 
-def _get_pixels_near_point(pixels, point, eps):
-    return set(pixel for pixel in pixels if distance_between_points_squared(pixel, point) <= eps**2)
+def _get_primitive_parse(segment_parse, primitives):
+    lines = dict(pair for pair in primitives.iteritems()
+                 if isinstance(pair[1], instantiators['line']))
+    circles = dict(pair for pair in primitives.iteritems()
+                   if isinstance(pair[1], instantiators['circle']))
+    return PrimitiveParse(segment_parse, lines, circles)
+
+
+def _get_pixels_dict(pixels, primitives, line_eps, circle_eps):
+    """
+    Pixel coverage of each of the primitives (and of each line's end points) as boolean masks
+    over the pixel array of the diagram segment.
+    Masks of all lines and all circles are computed in one batched pass each.
+
+    :param pixels: pixels of the diagram segment
+    :param dict primitives: candidate primitives, e.g. those kept by _get_supported_primitives
+    :param line_eps:
+    :param circle_eps:
+    :return dict:
+    """
+    pixel_array = get_pixel_array(pixels)
+    pixels_dict = {'all': np.ones(len(pixel_array), dtype=bool)}
+
+    line_keys = [key for key, primitive in primitives.iteritems() if isinstance(primitive, instantiators['line'])]
+    circle_keys = [key for key, primitive in primitives.iteritems() if isinstance(primitive, instantiators['circle'])]
+    lines = [primitives[key] for key in line_keys]
+    circles = [primitives[key] for key in circle_keys]
+
+    line_masks = get_line_masks(pixel_array, lines, line_eps)
+    a_masks = get_point_masks(pixel_array, [line.a for line in lines], line_eps)
+    b_masks = get_point_masks(pixel_array, [line.b for line in lines], line_eps)
+    for idx, key in enumerate(line_keys):
+        pixels_dict[key] = line_masks[idx]
+        pixels_dict[lines[idx].a] = a_masks[idx]
+        pixels_dict[lines[idx].b] = b_masks[idx]
+
+    circle_masks = get_circle_masks(pixel_array, circles, circle_eps)
+    for idx, key in enumerate(circle_keys):
+        pixels_dict[key] = circle_masks[idx]
+    return pixels_dict
 
 
 def _evaluate_reward(partial_primitives, pixels_dict):
+    """
+    Reward of partial_primitives computed from scratch.
+    select_primitives uses the equivalent _IncrementalReward instead.
+
+    :param partial_primitives:
+    :param pixels_dict:
+    :return float:
+    """
     x = [_coverage(partial_primitives, pixels_dict),
          _pixel_num(partial_primitives, pixels_dict),
          _length_sum(partial_primitives),
          _coherence(partial_primitives),
          _end_pixel_num(partial_primitives, pixels_dict),
          ]
+    return _reward(x)
+
+
+def _reward(x):
     w = [1, -0.1, -0.7, 00, 0.1]
     return np.dot(x, w)
 
@@ -100,58 +311,24 @@ def _evaluate_reward(partial_primitives, pixels_dict):
 def _coverage(partial_primitives, pixels_dict):
     if len(partial_primitives) == 0:
         return 0
-    coverage = len(set.union(*[pixels_dict[key] for key in partial_primitives]))
+    coverage = mask_union_size([pixels_dict[key] for key in partial_primitives])
     return coverage
 
 
 def _pixel_num(partial_primitives, pixels_dict):
     if len(partial_primitives) == 0:
         return 0
-    num = sum(len(pixels_dict[key]) for key in partial_primitives)
+    num = sum(np.count_nonzero(pixels_dict[key]) for key in partial_primitives)
     return num
 
 def _end_pixel_num(partial_primitives, pixels_dict):
     lines = _get_lines(partial_primitives)
     if len(lines) == 0:
         return 0
-    coverage = set.union(*[pixels_dict[primitive.a] for primitive in lines])
-    coverage2 = set.union(*[pixels_dict[primitive.b] for primitive in lines])
-    return len(set.union(coverage, coverage2))
-
+    masks = [pixels_dict[primitive.a] for primitive in lines] + [pixels_dict[primitive.b] for primitive in lines]
+    return mask_union_size(masks)
 
 
-def _get_pixels_near_line(pixels, line, eps):
-    """
-    This can be replaced with shorter, more inefficient code.
-    Written to boost up the speed.
-    :param pixels:
-    :param line:
-    :param eps:
-    :return:
-    """
-    #return set(pixel for pixel in pixels if distance_between_line_and_point(line, pixel) <= eps)
-
-    p = midpoint(line.a, line.b)
-    u = line_unit_vector(line)
-    n = line_normal_vector(line)
-    half_length = line_length(line)/2.0
-    eps_squared = eps**2
-
-    near_pixels = set()
-    for point in pixels:
-        vector = point.x - p.x, point.y - p.y
-        perpendicular_distance = abs(np.dot(vector, n))
-        if perpendicular_distance > eps:
-            continue
-        parallel_distance = abs(np.dot(vector, u))
-        if parallel_distance <= half_length:
-            near_pixels.add(point)
-        else:
-            if distance_between_points_squared(point, line.a) <= eps_squared or \
-                    distance_between_points_squared(point, line.b) <= eps_squared:
-                near_pixels.add(point)
-    return near_pixels
-
 
 def _length_sum(partial_primitives):
     """
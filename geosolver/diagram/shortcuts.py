@@ -1,3 +1,8 @@
+import copy
+import logging
+from multiprocessing import Pool
+
+from geosolver.diagram.parse_cache import load_parses, save_parses
 from geosolver.diagram.parse_core import parse_core
 from geosolver.diagram.parse_graph import parse_graph
 from geosolver.diagram.parse_image_segments import parse_image_segments
@@ -7,10 +12,84 @@ from geosolver.diagram.select_primitives import select_primitives
 __author__ = 'minjoon'
 
 
-def diagram_to_graph_parse(diagram):
+def diagram_to_graph_parse(diagram, use_cache=False):
+    """
+    :param numpy.ndarray diagram: grayscale image
+    :param bool use_cache: if True, the parse is loaded from (or saved to) the on-disk cache (see parse_cache)
+    :return GraphParse:
+    """
+    if use_cache:
+        parses = load_parses(diagram)
+        if parses is not None:
+            return parses[-1]
     image_segment_parse = parse_image_segments(diagram)
     primitive_parse = parse_primitives(image_segment_parse)
     selected_primitive_parse = select_primitives(primitive_parse)
     core_parse = parse_core(selected_primitive_parse)
     graph_parse = parse_graph(core_parse)
+    if use_cache:
+        save_parses(diagram, primitive_parse, selected_primitive_parse, graph_parse)
     return graph_parse
+
+
+def diagram_to_graph_parses(diagrams, workers=None):
+    """
+    Parses multiple diagrams over a pool of worker processes.
+    The output list is aligned with diagrams. Each element is a slim graph parse (see get_slim_graph_parse),
+    or None if parsing the corresponding diagram failed; the error is logged and the others are unaffected.
+
+    :param list diagrams: list of grayscale images (numpy.ndarray)
+    :param int workers: number of processes. Defaults to the number of CPUs.
+    :return list:
+    """
+    pool = Pool(workers)
+    try:
+        return pool.map(_diagram_to_slim_graph_parse, diagrams)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def get_slim_graph_parse(graph_parse):
+    """
+    Returns a shallow copy of graph_parse without the images and pixels held by its image segment parse.
+    The copy is cheap to pickle and can be used with get_instances, grounding, etc.,
+    but the display methods of its diagram segment are not available.
+    The offset and shape of the diagram segment are preserved.
+    The label segments are kept with their own segmented images (see ImageSegment.detach),
+    so labels can still be matched downstream.
+
+    :param GraphParse graph_parse:
+    :return GraphParse:
+    """
+    image_segment_parse = copy.copy(graph_parse.image_segment_parse)
+    diagram_image_segment = copy.copy(image_segment_parse.diagram_image_segment)
+    diagram_image_segment.release()
+    image_segment_parse.original_image = None
+    image_segment_parse.diagram_image_segment = diagram_image_segment
+    label_image_segments = {}
+    for key, label_image_segment in image_segment_parse.label_image_segments.iteritems():
+        label_image_segment = copy.copy(label_image_segment)
+        label_image_segment.detach()
+        label_image_segments[key] = label_image_segment
+    image_segment_parse.label_image_segments = label_image_segments
+
+    primitive_parse = copy.copy(graph_parse.primitive_parse)
+    primitive_parse.image_segment_parse = image_segment_parse
+    core_parse = copy.copy(graph_parse.core_parse)
+    core_parse.image_segment_parse = image_segment_parse
+    core_parse.primitive_parse = primitive_parse
+
+    slim_graph_parse = copy.copy(graph_parse)
+    slim_graph_parse.core_parse = core_parse
+    slim_graph_parse.primitive_parse = primitive_parse
+    slim_graph_parse.image_segment_parse = image_segment_parse
+    return slim_graph_parse
+
+
+def _diagram_to_slim_graph_parse(diagram):
+    try:
+        return get_slim_graph_parse(diagram_to_graph_parse(diagram))
+    except Exception:
+        logging.exception("Failed to parse diagram.")
+        return None
@@ -0,0 +1,45 @@
+"""
+Per-stage statistics of the diagram parsing pipeline.
+Each stage (parse_image_segments, parse_primitives, select_primitives, parse_core, parse_graph)
+attaches a dictionary with its wall time ('time', in seconds) and counters to the stats attribute of its output,
+and passes it to the stage hook if one is set (see set_stage_hook).
+"""
+import time
+
+__author__ = 'minjoon'
+
+_stage_hook = None
+
+
+def set_stage_hook(hook):
+    """
+    Sets the function called with (stage_name, stats) after each stage of the diagram parsing.
+    None disables the hook.
+
+    :param hook:
+    :return:
+    """
+    global _stage_hook
+    _stage_hook = hook
+
+
+def start_stage():
+    return time.time()
+
+
+def end_stage(stage_name, parse, start_time, **counters):
+    """
+    Attaches the wall time since start_time and the counters to parse.stats, and calls the stage hook.
+
+    :param str stage_name:
+    :param parse: output of the stage
+    :param float start_time: return value of start_stage
+    :param counters:
+    :return dict: stats
+    """
+    stats = dict(counters)
+    stats['time'] = time.time() - start_time
+    parse.stats = stats
+    if _stage_hook is not None:
+        _stage_hook(stage_name, stats)
+    return stats
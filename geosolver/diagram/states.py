@@ -1,21 +1,132 @@
 import cv2
+import numpy as np
 
 from geosolver.diagram.draw_on_image import draw_point, draw_instance, draw_label
+from geosolver.diagram.distance_transform import get_distance_transform
+from geosolver.diagram.pixel_coverage import get_pixel_array
+from geosolver.diagram.pixel_grid import PixelGrid
+from geosolver.ontology.instantiator_arrays import PointArray
+from geosolver.ontology.instantiator_definitions import instantiators
 from geosolver.utils.prep import display_image
 
 __author__ = 'minjoon'
 
 
 class ImageSegment(object):
-    def __init__(self, segmented_image, sliced_image, binarized_segmented_image, pixels, offset, key):
-        self.sliced_image = sliced_image
-        self.segmented_image = segmented_image
-        self.binarized_segmented_image = binarized_segmented_image
-        self.pixels = pixels
-        self.offset = offset
-        self.shape = segmented_image.shape
+    def __init__(self, image, labeled, slice_, label, key, block_size, c):
+        """
+        A connected component of the image.
+        Only references to the image and the label map (shared by all segments) and the slice are kept;
+        the images and pixels of the segment are computed on first access.
+
+        :param np.ndarray image: grayscale image
+        :param np.ndarray labeled: label map of the connected components of image
+        :param tuple slice_: bounding box of the segment in image
+        :param int label: label of the segment in labeled
+        :param key:
+        :param int block_size: block size of the adaptive thresholding of the segmented image
+        :param int c: constant of the adaptive thresholding of the segmented image
+        :return:
+        """
+        self.image = image
+        self.labeled = labeled
+        self.slice_ = slice_
+        self.label = label
+        self.block_size = block_size
+        self.c = c
+        self.offset = instantiators['point'](slice_[1].start, slice_[0].start)
+        self.shape = (slice_[0].stop - slice_[0].start, slice_[1].stop - slice_[1].start)
         self.key = key
-        self.area = segmented_image.shape[0] * segmented_image.shape[1]
+        self.area = self.shape[0] * self.shape[1]
+        self._segmented_image = None
+        self._binarized_segmented_image = None
+        self._pixels = None
+        self._pixel_grid = None
+        self._distance_transform = None
+
+    def release(self):
+        """
+        Drops the references to the image and the label map, and the cached images, pixels and their indexes.
+        Afterwards, the images and pixels of the segment are None.
+        """
+        self.image = None
+        self.labeled = None
+        self._segmented_image = None
+        self._binarized_segmented_image = None
+        self._pixels = None
+        self._pixel_grid = None
+        self._distance_transform = None
+
+    def detach(self):
+        """
+        Computes the segmented images, then drops the references to the image and the label map
+        that are shared by all segments.
+        Afterwards, the segmented images are still available, but the pixels of the segment are None
+        unless they have been accessed before.
+        """
+        self.segmented_image
+        self.binarized_segmented_image
+        self.image = None
+        self.labeled = None
+
+    @property
+    def sliced_image(self):
+        if self.image is None:
+            return None
+        return self.image[self.slice_]
+
+    @property
+    def boolean_array(self):
+        if self.labeled is None:
+            return None
+        return self.labeled[self.slice_] == self.label
+
+    @property
+    def segmented_image(self):
+        if self._segmented_image is None and self.image is not None:
+            self._segmented_image = 255 - (255-self.sliced_image) * self.boolean_array
+        return self._segmented_image
+
+    @property
+    def binarized_segmented_image(self):
+        if self._binarized_segmented_image is None and self.image is not None:
+            self._binarized_segmented_image = cv2.adaptiveThreshold(self.segmented_image, 255,
+                                                                     cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                                                     cv2.THRESH_BINARY_INV, self.block_size, self.c)
+        return self._binarized_segmented_image
+
+    @property
+    def pixels(self):
+        """
+        (x, y) of the pixels of the segment.
+
+        :return PointArray:
+        """
+        if self._pixels is None and self.labeled is not None:
+            self._pixels = PointArray(np.transpose(np.nonzero(np.transpose(self.boolean_array))))
+        return self._pixels
+
+    @property
+    def pixel_grid(self):
+        """
+        Spatial index over self.pixels, built on first access.
+
+        :return PixelGrid:
+        """
+        if self._pixel_grid is None:
+            self._pixel_grid = PixelGrid(get_pixel_array(self.pixels))
+        return self._pixel_grid
+
+    @property
+    def distance_transform(self):
+        """
+        Distance from each location of the segment to its nearest pixel, computed on first access.
+
+        :return np.ndarray:
+        """
+        if self._distance_transform is None:
+            self._distance_transform = get_distance_transform(get_pixel_array(self.pixels), self.shape)
+        return self._distance_transform
 
     def display_segmented_image(self, block=True):
         display_image(self.segmented_image, block=block)
@@ -43,6 +154,7 @@ class ImageSegmentParse(object):
         self.original_image = original_image
         self.diagram_image_segment = diagram_image_segment
         self.label_image_segments = label_image_segments
+        self.stats = {}  # see stage_stats
 
     def get_colored_original_image(self):
         return cv2.cvtColor(self.original_image, cv2.COLOR_GRAY2BGR)
@@ -71,6 +183,7 @@ class PrimitiveParse(object):
         self.lines = lines
         self.circles = circles
         self.primitives = dict(lines.items() + circles.items())
+        self.stats = {}  # see stage_stats
 
     def display_primitives(self, block=True, **kwargs):
         self.image_segment_parse.display_instances(self.primitives.values(), block=block, **kwargs)
@@ -93,6 +206,7 @@ class CoreParse(object):
         self.point_variables = point_variables
         self.radius_variables = radius_variables
         self.variable_assignment = assignment
+        self.stats = {}  # see stage_stats
 
     def get_image_points(self, **kwargs):
         image = self.image_segment_parse.get_colored_original_image()
@@ -121,6 +235,11 @@ class GraphParse(object):
         self.intersection_points = core_parse.intersection_points
         self.point_variables = core_parse.point_variables
         self.radius_variables = core_parse.radius_variables
+        self.stats = {}  # see stage_stats
+        # Filled lazily by get_instances.get_all_instances and get_instances.get_instances_with_point.
+        # Both are keyed by (instance_type_name, is_variable).
+        self.instance_catalog = {}  # {key: instance}
+        self.point_instance_index = {}  # {point_key: [key]}
 
     def display_instances(self, instances, block=True, **kwargs):
         self.image_segment_parse.display_instances(instances, block=block, **kwargs)
@@ -15,7 +15,7 @@ def test_parse_match_from_known_labels():
     for pk, question in questions.iteritems():
         label_data = geoserver_interface.download_labels(pk)[pk]
         diagram = open_image(question.diagram_path)
-        graph_parse = diagram_to_graph_parse(diagram)
+        graph_parse = diagram_to_graph_parse(diagram, use_cache=True)
         match_parse = parse_match_from_known_labels(graph_parse, label_data)
         for key, value in match_parse.match_dict.iteritems():
             print key, value
@@ -27,7 +27,7 @@ def test_parse_match_atoms():
     for pk, question in questions.iteritems():
         label_data = geoserver_interface.download_labels(pk)[pk]
         diagram = open_image(question.diagram_path)
-        graph_parse = diagram_to_graph_parse(diagram)
+        graph_parse = diagram_to_graph_parse(diagram, use_cache=True)
         match_parse = parse_match_from_known_labels(graph_parse, label_data)
         match_atoms = parse_match_atoms(match_parse)
         for match_atom in match_atoms:
@@ -47,7 +47,7 @@ def test_ground_atoms():
 
     label_data = geoserver_interface.download_labels(pk)[pk]
     diagram = open_image(question.diagram_path)
-    graph_parse = diagram_to_graph_parse(diagram)
+    graph_parse = diagram_to_graph_parse(diagram, use_cache=True)
     match_parse = parse_match_from_known_labels(graph_parse, label_data)
 
     AB = v('AB', 'line')
@@ -78,7 +78,7 @@ def test_solving():
 
     label_data = geoserver_interface.download_labels(pk)[pk]
     diagram = open_image(question.diagram_path)
-    graph_parse = diagram_to_graph_parse(diagram)
+    graph_parse = diagram_to_graph_parse(diagram, use_cache=True)
     match_parse = parse_match_from_known_labels(graph_parse, label_data)
 
     AB = v('AB', 'line')
@@ -100,7 +100,7 @@ def test_solving():
     atoms = confident_atoms + text_atoms
     grounded_qn = ground_formula_nodes(match_parse, [qn])[0]
 
-    ns = NumericSolver(atoms)
+    ns = NumericSolver(atoms, warm_start=graph_parse.core_parse)
 
     print ns.evaluate(grounded_qn)
 
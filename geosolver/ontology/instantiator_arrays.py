@@ -0,0 +1,139 @@
+"""
+Structure-of-arrays counterparts of the instantiators in instantiator_definitions.
+Each class stores many instances of the same type in one contiguous float64 array (one row per instance).
+Column accessors (e.g. PointArray.x, LineArray.a, CircleArray.radius) are views into that array,
+and indexing with an integer returns the corresponding instantiator namedtuple,
+so that code written for a list of namedtuples keeps working.
+"""
+import numpy as np
+
+from geosolver.ontology.instantiator_definitions import instantiators
+
+__author__ = 'minjoon'
+
+
+class InstanceArray(object):
+    width = None
+
+    def __init__(self, array):
+        array = np.asarray(array, dtype=np.float64)
+        if array.ndim != 2:
+            array = array.reshape(-1, self.width)
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def __iter__(self):
+        for row in self.array.tolist():
+            yield self._instantiate(row)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, long, np.integer)):
+            return self._instantiate(self.array[index].tolist())
+        return self.__class__(self.array[index])
+
+    def _instantiate(self, row):
+        raise NotImplementedError()
+
+
+class PointArray(InstanceArray):
+    """
+    (N, 2) array of (x, y).
+    """
+    width = 2
+
+    @classmethod
+    def from_points(cls, points):
+        return cls([(point.x, point.y) for point in points])
+
+    @property
+    def x(self):
+        return self.array[:, 0]
+
+    @property
+    def y(self):
+        return self.array[:, 1]
+
+    def _instantiate(self, row):
+        return instantiators['point'](*row)
+
+
+class LineArray(InstanceArray):
+    """
+    (N, 4) array of (a.x, a.y, b.x, b.y).
+    """
+    width = 4
+
+    @classmethod
+    def from_lines(cls, lines):
+        return cls([(line.a.x, line.a.y, line.b.x, line.b.y) for line in lines])
+
+    @property
+    def a(self):
+        return PointArray(self.array[:, 0:2])
+
+    @property
+    def b(self):
+        return PointArray(self.array[:, 2:4])
+
+    def _instantiate(self, row):
+        return instantiators['line'](instantiators['point'](*row[0:2]), instantiators['point'](*row[2:4]))
+
+
+class CircleArray(InstanceArray):
+    """
+    (N, 3) array of (center.x, center.y, radius).
+    """
+    width = 3
+
+    @classmethod
+    def from_circles(cls, circles):
+        return cls([(circle.center.x, circle.center.y, circle.radius) for circle in circles])
+
+    @property
+    def center(self):
+        return PointArray(self.array[:, 0:2])
+
+    @property
+    def radius(self):
+        return self.array[:, 2]
+
+    def _instantiate(self, row):
+        return instantiators['circle'](instantiators['point'](*row[0:2]), row[2])
+
+
+class ArcArray(InstanceArray):
+    """
+    (N, 7) array of (circle.center.x, circle.center.y, circle.radius, a.x, a.y, b.x, b.y).
+    """
+    width = 7
+
+    @classmethod
+    def from_arcs(cls, arcs):
+        return cls([(arc.circle.center.x, arc.circle.center.y, arc.circle.radius, arc.a.x, arc.a.y, arc.b.x, arc.b.y)
+                    for arc in arcs])
+
+    @property
+    def circle(self):
+        return CircleArray(self.array[:, 0:3])
+
+    @property
+    def a(self):
+        return PointArray(self.array[:, 3:5])
+
+    @property
+    def b(self):
+        return PointArray(self.array[:, 5:7])
+
+    def _instantiate(self, row):
+        circle = instantiators['circle'](instantiators['point'](*row[0:2]), row[2])
+        return instantiators['arc'](circle, instantiators['point'](*row[3:5]), instantiators['point'](*row[5:7]))
+
+
+instantiator_arrays = {
+    'point': PointArray,
+    'line': LineArray,
+    'circle': CircleArray,
+    'arc': ArcArray,
+}
@@ -29,6 +29,7 @@ class Polygon(tuple):
 
 """
 Initialize instantiators based on type_defs
+Each namedtuple is also bound to a module attribute of the same name so that instances can be pickled.
 """
 instantiators = {}
 instantiators['polygon'] = Polygon
@@ -36,6 +37,7 @@ for key, value in instantiator_defs.iteritems():
     args, _ = zip(*value)
     nt = namedtuple(key, ' '.join(args))
     instantiators[key] = nt
+    globals()[key] = nt
 
 
 def polygon(*args):
@@ -6,9 +6,12 @@ __author__ = 'minjoon'
 """
 eps is used to segment the line.
 It shouldn't be too big; otherwise, off-line will be matched.
+max_num_segments is the budget of line candidates passed to primitive selection;
+segments with the largest pixel support are kept. None means no budget.
 """
 HoughLineParameters = namedtuple("HoughLineParameters",
-                                 "rho theta threshold max_gap min_length nms_rho nms_theta max_num eps")
+                                 "rho theta threshold max_gap min_length nms_rho nms_theta max_num eps "
+                                 "max_num_segments")
 
 hough_line_parameters = HoughLineParameters(rho=1,
                                             theta=np.pi/180,
@@ -18,7 +21,8 @@ hough_line_parameters = HoughLineParameters(rho=1,
                                             nms_rho=2,
                                             nms_theta=np.pi/60,
                                             max_num=40,
-                                            eps=2)
+                                            eps=2,
+                                            max_num_segments=None)
 
 HoughCircleParameters = namedtuple("HoughCircleParameters",
                                    "dp minRadius maxRadius param1 param2 minDist max_gap min_length max_num")
@@ -40,3 +44,25 @@ PRIMITIVE_SELECTION_MIN_GAIN = 0
 
 INTERSECTION_EPS = 3
 KMEANS_RADIUS_THRESHOLD = 6
+# 'radius' for single-pass radius-bounded clustering, 'kmeans' for increasing the number of KMeans clusters.
+# Both guarantee that every cluster's radius is at most KMEANS_RADIUS_THRESHOLD.
+INTERSECTION_CLUSTERING = 'radius'
+
+"""
+Backend used to score the pixel support of lines, arcs and circles in instance_exists.
+'pixels' counts the diagram pixels near the instance.
+'distance_transform' samples the distance transform of the diagram segment along the instance,
+and requires the given fraction of the samples to be within eps of a pixel.
+"""
+SUPPORT_BACKEND = 'pixels'
+DISTANCE_TRANSFORM_MIN_SUPPORT = 0.9
+
+"""
+Prefilter of the candidates of select_primitives. None keeps all candidates.
+'distance_transform' discards candidates whose distance transform support (see SUPPORT_BACKEND)
+is below DISTANCE_TRANSFORM_MIN_CANDIDATE_SUPPORT before selection;
+this is lower than DISTANCE_TRANSFORM_MIN_SUPPORT so that partially drawn circles survive.
+It only prefilters: the selection reward is still computed from the pixels near each candidate.
+"""
+SELECTION_PREFILTER = None
+DISTANCE_TRANSFORM_MIN_CANDIDATE_SUPPORT = 0.5
@@ -3,9 +3,14 @@ Contains non-parametric constants used throughout the module.
 That is, DO NOT include performance-affecting parameters here.
 Instead, place parameters in paramters.py
 """
+import os
+
 __author__ = 'minjoon'
 
 
 STANFORD_PARSER_SERVER_URL = "http://54.191.196.60:9000/dep"
 STANFORD_TOKENIZER_URL = "http://localhost:9000/tok"
 GEOSERVER_URL = "http://localhost:8000"
+
+# Directory of the on-disk cache of diagram parses (see geosolver.diagram.parse_cache).
+DIAGRAM_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".geosolver", "diagram_cache")
@@ -0,0 +1,559 @@
+"""
+Compilation of atoms into a flat program over the variable vector of a VariableHandler.
+compile_atoms walks each atom once with functions mirroring those in ontology_semantics,
+and records every arithmetic operation on numbers as an instruction writing to a register array.
+Variables and constants occupy the first registers. Instructions with the same operation that do not depend
+on each other are grouped, so evaluating the program costs one numpy call per group instead of a walk
+over the formula nodes with a dictionary of the assignment.
+Atoms with functions that cannot be compiled are evaluated with ontology_semantics.evaluate.
+The gradient of the program is computed by a reverse pass over the same groups (see AtomProgram.backward),
+using the partial derivatives of each operation in partials.
+"""
+import numbers
+import sys
+
+import numpy as np
+
+from geosolver.ontology.instantiator_definitions import instantiators
+from geosolver.ontology.ontology_semantics import evaluate
+from geosolver.text2.ontology import FormulaNode
+
+this = sys.modules[__name__]
+
+__author__ = 'minjoon'
+
+
+def _where_less_equal(a, b, x, y):
+    return np.where(a <= b, x, y)
+
+
+operations = {
+    'add': np.add,
+    'sub': np.subtract,
+    'mul': np.multiply,
+    'div': np.true_divide,
+    'pow': np.power,
+    'sqrt': np.sqrt,
+    'abs': np.abs,
+    'min': np.minimum,
+    'where_le': _where_less_equal,
+}
+
+
+def _sqrt_partial(out, a):
+    # zero at 0, where sqrt is not differentiable
+    return 0.5 / np.where(out > 0, out, np.inf)
+
+
+# For each operation, the partial derivative of its output with respect to each argument as a function of
+# (output, *arguments), or None where the output is piecewise constant in the argument.
+partials = {
+    'add': (lambda out, a, b: 1.0, lambda out, a, b: 1.0),
+    'sub': (lambda out, a, b: 1.0, lambda out, a, b: -1.0),
+    'mul': (lambda out, a, b: b, lambda out, a, b: a),
+    'div': (lambda out, a, b: 1.0 / b, lambda out, a, b: -out / b),
+    'pow': (lambda out, a, b: b * a**(b - 1), lambda out, a, b: out * np.log(a)),
+    'sqrt': (_sqrt_partial,),
+    'abs': (lambda out, a: np.sign(a),),
+    'min': (lambda out, a, b: a <= b, lambda out, a, b: a > b),
+    'where_le': (None, None, lambda out, a, b, x, y: a <= b, lambda out, a, b, x, y: a > b),
+}
+
+
+class UnsupportedFunction(Exception):
+    pass
+
+
+class CompiledTruthValue(object):
+    def __init__(self, terms):
+        """
+        Compiled counterpart of TruthValue.
+        Its norm is the sum of abs(value) over the 'eq' terms and max(value, 0) over the 'ineq' terms.
+
+        :param list terms: list of (kind, register) where kind is 'eq' or 'ineq'
+        :return:
+        """
+        self.terms = terms
+
+    def __add__(self, other):
+        return CompiledTruthValue(self.terms + other.terms)
+
+
+class AtomProgram(object):
+    def __init__(self, variable_names):
+        """
+        :param list variable_names: names of the variables in the order of the variable vector
+        :return:
+        """
+        self.variable_names = list(variable_names)
+        self.variable_registers = {name: idx for idx, name in enumerate(self.variable_names)}
+        self.num_registers = len(self.variable_names)
+        self.instructions = []
+        self.constants = []
+        self.num_atoms = 0
+        self.truth_terms = []
+        self.fallback_atoms = []
+        self._register_levels = [0] * self.num_registers
+        self._constant_registers = {}
+        self._constant_values = {}
+        self._instruction_registers = {}
+        self._schedule = None
+        self._backward_schedule = None
+        self._terms = None
+
+    def constant(self, value):
+        value = float(value)
+        if value not in self._constant_registers:
+            register = self._new_register(0)
+            self.constants.append((register, value))
+            self._constant_registers[value] = register
+            self._constant_values[register] = value
+        return self._constant_registers[value]
+
+    def apply(self, operation, *registers):
+        """
+        Register holding the operation applied to the registers.
+        Identical instructions are recorded once, and operations on constants are evaluated right away,
+        so that every instruction depends on the variables.
+
+        :param str operation: key of operations
+        :param registers:
+        :return int:
+        """
+        if all(each in self._constant_values for each in registers):
+            return self.constant(operations[operation](*[self._constant_values[each] for each in registers]))
+        key = (operation,) + registers
+        if key not in self._instruction_registers:
+            register = self._new_register(1 + max(self._register_levels[each] for each in registers))
+            self.instructions.append((operation, register, registers))
+            self._instruction_registers[key] = register
+            self._schedule = None
+            self._backward_schedule = None
+        return self._instruction_registers[key]
+
+    def add_atom(self, atom):
+        """
+        Compiles the atom, or evaluates it with ontology_semantics.evaluate if it cannot be compiled.
+
+        :param FormulaNode atom:
+        :return int: index of the atom
+        """
+        atom_idx = self.num_atoms
+        self.num_atoms += 1
+        try:
+            truth = self.compile(atom, {})
+        except UnsupportedFunction:
+            truth = None
+        if isinstance(truth, CompiledTruthValue):
+            self.truth_terms.extend((atom_idx, kind, register) for kind, register in truth.terms)
+        else:
+            self.fallback_atoms.append((atom_idx, atom))
+        self._terms = None
+        return atom_idx
+
+    def compile(self, node, memo):
+        """
+        Compiled value of the node: a register for a number, an instance of registers for an entity
+        (e.g. point(x=register, y=register)), or a CompiledTruthValue for a truth.
+
+        :param node:
+        :param dict memo: compiled values of the nodes visited so far, by id
+        :return:
+        """
+        if not isinstance(node, FormulaNode):
+            if not isinstance(node, numbers.Number):
+                raise UnsupportedFunction(repr(node))
+            return self.constant(node)
+        if id(node) not in memo:
+            if node.is_leaf():
+                memo[id(node)] = self.variable_registers[node.signature.id]
+            elif node.signature.id in compiled_functions:
+                args = [self.compile(child, memo) for child in node.children]
+                memo[id(node)] = compiled_functions[node.signature.id](self, *args)
+            else:
+                raise UnsupportedFunction(node.signature.id)
+        return memo[id(node)]
+
+    def run(self, vector):
+        """
+        Values of all registers.
+        vector can also be a (num_variables, K) array of K vectors, in which case so is each register.
+
+        :param np.ndarray vector:
+        :return np.ndarray: (num_registers,) or (num_registers, K) array
+        """
+        vector = np.asarray(vector, dtype=float)
+        constant_registers, constant_values, schedule = self._get_schedule()
+        registers = np.empty((self.num_registers,) + vector.shape[1:])
+        registers[:len(self.variable_names)] = vector
+        registers[constant_registers] = constant_values.reshape((-1,) + (1,) * (vector.ndim - 1))
+        for function, out_registers, in_registers in schedule:
+            registers[out_registers] = function(*[registers[each] for each in in_registers])
+        return registers
+
+    def norms(self, vector):
+        """
+        Norm of the truth value of each atom (see TruthValue).
+
+        :param np.ndarray vector:
+        :return np.ndarray: (num_atoms,) or (num_atoms, K) array
+        """
+        vector = np.asarray(vector, dtype=float)
+        return self._get_norms(vector, self.run(vector))
+
+    def __call__(self, vector):
+        """
+        Sum of the norms of the atoms, i.e. the objective of find_assignment.
+        """
+        return self.norms(vector).sum(axis=0)
+
+    def value_and_gradient(self, vector):
+        """
+        Sum of the norms of the atoms and its gradient with respect to the variable vector.
+        The norm of an 'eq' term is abs(value), whose derivative is taken to be sign(value),
+        and the norm of an 'ineq' term is max(value, 0), whose derivative is taken to be 1 if value > 0 and 0 otherwise.
+        The gradient of the atoms that are not compiled is estimated by forward differences.
+
+        :param np.ndarray vector:
+        :return tuple: (float, np.ndarray)
+        """
+        vector = np.asarray(vector, dtype=float)
+        registers = self.run(vector)
+        norms = self._get_norms(vector, registers)
+        adjoints = np.zeros(self.num_registers)
+        if self.truth_terms:
+            term_registers, term_is_equality, _, _ = self._get_terms()
+            values = registers[term_registers]
+            seeds = np.where(term_is_equality, np.sign(values), values > 0)
+            adjoints += np.bincount(term_registers, seeds, minlength=self.num_registers)
+        gradient = self.backward(registers, adjoints)
+        if self.fallback_atoms:
+            gradient += self._get_fallback_jacobian(vector).sum(axis=0)
+        return norms.sum(), gradient
+
+    def gradient(self, vector):
+        return self.value_and_gradient(vector)[1]
+
+    def residuals(self, vector):
+        """
+        Residual of each term, followed by the norm of each atom that is not compiled.
+        The residual of an 'eq' term is its value and that of an 'ineq' term is max(value, 0),
+        so the sum of the absolute values of the residuals is the sum of the norms of the atoms.
+
+        :param np.ndarray vector:
+        :return np.ndarray: (num_residuals,) array
+        """
+        vector = np.asarray(vector, dtype=float)
+        registers = self.run(vector)
+        residuals = [self._get_term_residuals(registers)]
+        if self.fallback_atoms:
+            assignment = dict(zip(self.variable_names, vector))
+            residuals.append([evaluate(atom, assignment).norm for _, atom in self.fallback_atoms])
+        return np.concatenate(residuals)
+
+    def jacobian(self, vector):
+        """
+        Jacobian of the residuals with respect to the variable vector (see residuals),
+        from one reverse pass seeded with all residuals at once.
+        The rows of the atoms that are not compiled are estimated by forward differences.
+
+        :param np.ndarray vector:
+        :return np.ndarray: (num_residuals, num_variables) array
+        """
+        vector = np.asarray(vector, dtype=float)
+        registers = self.run(vector)
+        rows = []
+        if self.truth_terms:
+            term_registers, term_is_equality, _, _ = self._get_terms()
+            num_terms = len(term_registers)
+            adjoints = np.zeros((self.num_registers, num_terms))
+            adjoints[term_registers, np.arange(num_terms)] = term_is_equality | (registers[term_registers] > 0)
+            rows.append(self.backward(registers, adjoints).T)
+        if self.fallback_atoms:
+            rows.append(self._get_fallback_jacobian(vector))
+        return np.vstack(rows)
+
+    def backward(self, registers, adjoints):
+        """
+        Reverse pass: given the adjoints of the registers, i.e. the derivatives of some output with respect to them
+        when they are treated as independent, accumulates them into the adjoints of the variables.
+        adjoints can also be a (num_registers, M) array to differentiate M outputs at once.
+
+        :param np.ndarray registers: (num_registers,) array returned by run
+        :param np.ndarray adjoints: (num_registers,) or (num_registers, M) array; modified in place
+        :return np.ndarray: (num_variables,) or (num_variables, M) array
+        """
+        for out_registers, in_registers, arguments in self._get_backward_schedule():
+            out_adjoints = adjoints[out_registers].T
+            if not out_adjoints.any():
+                continue
+            out = registers[out_registers]
+            values = [registers[each] for each in in_registers]
+            for partial, argument_registers, selection, is_unique in arguments:
+                contributions = (out_adjoints * partial(out, *values)).T
+                if selection is not None:
+                    contributions = contributions[selection]
+                if is_unique:
+                    adjoints[argument_registers] += contributions
+                elif adjoints.ndim == 1:
+                    adjoints += np.bincount(argument_registers, contributions, minlength=len(adjoints))
+                else:
+                    np.add.at(adjoints, argument_registers, contributions)
+        return adjoints[:len(self.variable_names)]
+
+    def __getstate__(self):
+        # schedules hold the functions in partials, which cannot be pickled; they are rebuilt on demand
+        state = self.__dict__.copy()
+        state['_schedule'] = state['_backward_schedule'] = state['_terms'] = None
+        return state
+
+    def _get_norms(self, vector, registers):
+        norms = np.zeros((self.num_atoms,) + vector.shape[1:])
+        if self.truth_terms:
+            term_registers, term_is_equality, atom_indices, atom_starts = self._get_terms()
+            values = registers[term_registers]
+            values = np.where(term_is_equality.reshape((-1,) + (1,) * (vector.ndim - 1)),
+                              np.abs(values), np.maximum(values, 0))
+            norms[atom_indices] = np.add.reduceat(values, atom_starts, axis=0)
+        for atom_idx, atom in self.fallback_atoms:
+            if vector.ndim == 1:
+                norms[atom_idx] = evaluate(atom, dict(zip(self.variable_names, vector))).norm
+            else:
+                norms[atom_idx] = [evaluate(atom, dict(zip(self.variable_names, column))).norm
+                                   for column in vector.T]
+        return norms
+
+    def _get_term_residuals(self, registers):
+        if not self.truth_terms:
+            return np.zeros(0)
+        term_registers, term_is_equality, _, _ = self._get_terms()
+        values = registers[term_registers]
+        return np.where(term_is_equality, values, np.maximum(values, 0))
+
+    def _get_fallback_jacobian(self, vector):
+        """
+        Forward-difference Jacobian of the norms of the atoms that are not compiled.
+        """
+        def get_norms(assignment_vector):
+            assignment = dict(zip(self.variable_names, assignment_vector))
+            return np.array([evaluate(atom, assignment).norm for _, atom in self.fallback_atoms])
+
+        norms = get_norms(vector)
+        steps = np.sqrt(np.finfo(float).eps) * np.maximum(1, np.abs(vector))
+        jacobian = np.zeros((len(self.fallback_atoms), len(vector)))
+        for idx, step in enumerate(steps):
+            stepped_vector = vector.copy()
+            stepped_vector[idx] += step
+            jacobian[:, idx] = (get_norms(stepped_vector) - norms) / step
+        return jacobian
+
+    def _new_register(self, level):
+        register = self.num_registers
+        self.num_registers += 1
+        self._register_levels.append(level)
+        return register
+
+    def _get_terms(self):
+        """
+        Register of each term and whether it is an 'eq' term, and the compiled atoms with the index of their first term.
+        Terms are ordered by atom.
+        """
+        if self._terms is None:
+            atom_indices, kinds, term_registers = zip(*self.truth_terms)
+            atom_indices = np.array(atom_indices, dtype=int)
+            atom_starts = np.flatnonzero(np.r_[True, atom_indices[1:] != atom_indices[:-1]])
+            self._terms = (np.array(term_registers, dtype=int), np.array([kind == 'eq' for kind in kinds]),
+                           atom_indices[atom_starts], atom_starts)
+        return self._terms
+
+    def _get_groups(self):
+        """
+        Instructions grouped by level and operation, in increasing order of level.
+        Instructions of a level only depend on registers of lower levels.
+        Each group is (operation, (N, 1 + arity) array of the output register and argument registers).
+        """
+        groups = {}
+        for operation, register, registers in self.instructions:
+            groups.setdefault((self._register_levels[register], operation), []).append((register,) + registers)
+        return [(operation, np.array(groups[(level, operation)], dtype=int)) for level, operation in sorted(groups)]
+
+    def _get_schedule(self):
+        """
+        Constant registers and values, and (function, out_registers, in_registers) for each group of instructions.
+        """
+        if self._schedule is None:
+            schedule = [(operations[operation], array[:, 0], [array[:, idx] for idx in range(1, array.shape[1])])
+                        for operation, array in self._get_groups()]
+            constant_registers = np.array([register for register, _ in self.constants], dtype=int)
+            constant_values = np.array([value for _, value in self.constants], dtype=float)
+            self._schedule = constant_registers, constant_values, schedule
+        return self._schedule
+
+    def _get_backward_schedule(self):
+        """
+        The groups in reverse order, each with (partial, registers, selection, is_unique)
+        for each argument with respect to which the output is differentiable.
+        selection picks the instructions whose argument is not a constant (None if all are),
+        and is_unique tells whether the selected registers are distinct.
+        """
+        if self._backward_schedule is None:
+            backward_schedule = []
+            for operation, array in reversed(self._get_groups()):
+                arguments = []
+                for idx, partial in enumerate(partials[operation]):
+                    argument_registers = array[:, idx + 1]
+                    is_variable = np.array([each not in self._constant_values for each in argument_registers])
+                    if partial is None or not np.any(is_variable):
+                        continue
+                    selection = None if np.all(is_variable) else np.flatnonzero(is_variable)
+                    if selection is not None:
+                        argument_registers = argument_registers[selection]
+                    is_unique = len(np.unique(argument_registers)) == len(argument_registers)
+                    arguments.append((partial, argument_registers, selection, is_unique))
+                backward_schedule.append((array[:, 0], [array[:, idx] for idx in range(1, array.shape[1])],
+                                          arguments))
+            self._backward_schedule = backward_schedule
+        return self._backward_schedule
+
+
+def compile_atoms(variable_handler, atoms):
+    """
+    Compiles the atoms over the current variables of the variable handler.
+    The returned program maps a vector ordered as variable_handler.dict_to_vector() to the sum of the norms
+    of the atoms, like the objective built from ontology_semantics.evaluate.
+
+    :param VariableHandler variable_handler:
+    :param list atoms:
+    :return AtomProgram:
+    """
+    program = AtomProgram(variable_handler.variables.keys())
+    for atom in atoms:
+        program.add_atom(atom)
+    return program
+
+
+def _distance_between_points(program, p0, p1):
+    dx, dy = program.apply('sub', p0.x, p1.x), program.apply('sub', p0.y, p1.y)
+    return program.apply('sqrt', program.apply('add', program.apply('mul', dx, dx), program.apply('mul', dy, dy)))
+
+
+def _distance_between_line_and_point(program, line, point):
+    """
+    See computational_geometry.distance_between_line_and_point.
+    """
+    dx, dy = program.apply('sub', line.b.x, line.a.x), program.apply('sub', line.b.y, line.a.y)
+    length = _distance_between_points(program, line.a, line.b)
+    ux, uy = program.apply('div', dx, length), program.apply('div', dy, length)
+    two = program.constant(2.0)
+    vx = program.apply('sub', point.x, program.apply('div', program.apply('add', line.a.x, line.b.x), two))
+    vy = program.apply('sub', point.y, program.apply('div', program.apply('add', line.a.y, line.b.y), two))
+    perpendicular_distance = program.apply('abs', program.apply('sub', program.apply('mul', vx, uy),
+                                                                program.apply('mul', vy, ux)))
+    parallel_distance = program.apply('abs', program.apply('add', program.apply('mul', vx, ux),
+                                                           program.apply('mul', vy, uy)))
+    end_distance = program.apply('min', _distance_between_points(program, point, line.a),
+                                 _distance_between_points(program, point, line.b))
+    return program.apply('where_le', parallel_distance, program.apply('div', length, two),
+                         perpendicular_distance, end_distance)
+
+
+def Line(program, p1, p2):
+    return instantiators['line'](p1, p2)
+
+def Arc(program, circle, p1, p2):
+    return instantiators['arc'](circle, p1, p2)
+
+def Circle(program, p, r):
+    return instantiators['circle'](p, r)
+
+def Point(program, x, y):
+    return instantiators['point'](x, y)
+
+def Angle(program, a, b, c):
+    return instantiators['angle'](a, b, c)
+
+def Triangle(program, a, b, c):
+    return instantiators['triangle'](a, b, c)
+
+def Quad(program, a, b, c, d):
+    return instantiators['quad'](a, b, c, d)
+
+def Hexagon(program, a, b, c, d, e, f):
+    return instantiators['polygon'](a, b, c, d, e, f)
+
+def Polygon(program, *p):
+    return instantiators['polygon'](*p)
+
+def LengthOf(program, line):
+    return _distance_between_points(program, line.a, line.b)
+
+def RadiusOf(program, circle):
+    return circle.radius
+
+def Equals(program, a, b):
+    return CompiledTruthValue([('eq', program.apply('sub', a, b))])
+
+def Greater(program, a, b):
+    return CompiledTruthValue([('ineq', program.apply('sub', b, a))])
+
+def Less(program, a, b):
+    return CompiledTruthValue([('ineq', program.apply('sub', a, b))])
+
+def Sqrt(program, x):
+    return program.apply('sqrt', x)
+
+def Add(program, a, b):
+    return program.apply('add', a, b)
+
+def Sub(program, a, b):
+    return program.apply('sub', a, b)
+
+def Mul(program, a, b):
+    return program.apply('mul', a, b)
+
+def Div(program, a, b):
+    return program.apply('div', a, b)
+
+def Pow(program, a, b):
+    return program.apply('pow', a, b)
+
+def Tangent(program, line, circle):
+    d = _distance_between_line_and_point(program, line, circle.center)
+    return Equals(program, d, circle.radius)
+
+def IsDiameterLineOf(program, line, circle):
+    return IsChordOf(program, line, circle) + \
+        Equals(program, LengthOf(program, line), Mul(program, program.constant(2), circle.radius))
+
+def PointLiesOnCircle(program, point, circle):
+    d = _distance_between_points(program, point, circle.center)
+    return Equals(program, d, circle.radius)
+
+def IsChordOf(program, line, circle):
+    return PointLiesOnCircle(program, line.a, circle) + PointLiesOnCircle(program, line.b, circle)
+
+def Perpendicular(program, l1, l2):
+    return Equals(program, Mul(program, Sub(program, l1.b.y, l1.a.y), Sub(program, l2.b.y, l2.a.y)),
+                  Mul(program, Sub(program, l1.a.x, l1.b.x), Sub(program, l2.b.x, l2.a.x)))
+
+def Colinear(program, A, B, C):
+    return Equals(program, Mul(program, Sub(program, B.y, A.y), Sub(program, C.x, B.x)),
+                  Mul(program, Sub(program, B.x, A.x), Sub(program, C.y, B.y)))
+
+def PointLiesOnLine(program, point, line):
+    return Colinear(program, line.a, point, line.b) + \
+        Equals(program, LengthOf(program, line), Add(program, _distance_between_points(program, line.a, point),
+                                                     _distance_between_points(program, line.b, point)))
+
+def IsMidpointOf(program, point, line):
+    line_a = Line(program, line.a, point)
+    line_b = Line(program, point, line.b)
+    return Equals(program, LengthOf(program, line_a), LengthOf(program, line_b)) + \
+        PointLiesOnLine(program, point, line)
+
+
+compiled_functions = {name: getattr(this, name) for name in
+                      ('Line', 'Arc', 'Circle', 'Point', 'Angle', 'Triangle', 'Quad', 'Hexagon', 'Polygon',
+                       'LengthOf', 'RadiusOf', 'Equals', 'Greater', 'Less', 'Sqrt', 'Add', 'Sub', 'Mul', 'Div',
+                       'Pow', 'Tangent', 'IsDiameterLineOf', 'PointLiesOnCircle', 'IsChordOf', 'Perpendicular',
+                       'Colinear', 'PointLiesOnLine', 'IsMidpointOf')}
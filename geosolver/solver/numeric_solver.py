@@ -1,7 +1,13 @@
-from scipy.optimize import minimize
+from contextlib import closing
+import cPickle
+from multiprocessing import Pool, TimeoutError, Value
+import time
+
+from scipy.optimize import minimize, least_squares
 import numpy as np
 
 from geosolver.ontology.ontology_semantics import evaluate
+from geosolver.solver.compile_atoms import compile_atoms
 from geosolver.solver.variable_handler import VariableHandler
 from geosolver.text2.ontology import FormulaNode
 
@@ -9,26 +15,49 @@ __author__ = 'minjoon'
 
 
 class NumericSolver(object):
-    def __init__(self, prior_atoms, variable_handler=None, max_num_resets=10, tol=10**-3):
+    def __init__(self, prior_atoms, variable_handler=None, max_num_resets=10, tol=10**-3, method='SLSQP',
+                 workers=1, seed=None, time_limit=None, warm_start=None):
+        """
+        :param list prior_atoms:
+        :param VariableHandler variable_handler:
+        :param int max_num_resets: number of starts of the optimizer
+        :param float tol:
+        :param str method: 'SLSQP' minimizes the sum of the norms of the atoms,
+        'trf' or 'lm' solves the least squares problem on their residuals (see find_assignment)
+        :param int workers: number of processes running starts concurrently (see find_assignment).
+        The processes are started on the first call that needs them and reused until close is called.
+        :param int seed: seed of the random starts
+        :param float time_limit: in seconds, per call of find_assignment
+        :param warm_start: CoreParse, or assignment dictionary like CoreParse.variable_assignment,
+        from which one extra start of the optimizer is initialized (see find_assignment)
+        :return:
+        """
         if variable_handler is None:
             variable_handler = VariableHandler()
+        if warm_start is not None:
+            variable_handler.warm_start(getattr(warm_start, 'variable_assignment', warm_start))
         self.variable_handler = variable_handler
         self.atoms = [variable_handler.add(prior_atom) for prior_atom in prior_atoms]
         self.max_num_resets = max_num_resets
         self.tol = tol
+        self.method = method
+        self.workers = workers
+        self.seed = seed
+        self.time_limit = time_limit
         self.assignment = None
         self.assigned = False
+        self.start_pool = None
 
     def is_sat(self):
         if not self.assigned:
-            self.assignment = find_assignment(self.variable_handler, self.atoms, self.max_num_resets, self.tol)
+            self.assignment = self._find_assignment(self.atoms)
             self.assigned = True
         return self.assignment is not None
 
     def query_invar(self, query_atom):
         query_atom = self.variable_handler.add(query_atom)
         if not self.assigned:
-            self.assignment = find_assignment(self.variable_handler, self.atoms, self.max_num_resets, self.tol)
+            self.assignment = self._find_assignment(self.atoms)
             self.assigned = True
         if not self.assignment:
             return False
@@ -36,25 +65,41 @@ class NumericSolver(object):
 
     def find_assignment(self, query_atom):
         query_atom = self.variable_handler.add(query_atom)
-        return find_assignment(self.variable_handler, self.atoms + [query_atom], self.max_num_resets, self.tol)
+        return self._find_assignment(self.atoms + [query_atom])
 
     def evaluate(self, variable_node):
         variable_node = self.variable_handler.add(variable_node)
         if not self.assigned:
-            self.assignment = find_assignment(self.variable_handler, self.atoms, self.max_num_resets, self.tol)
+            self.assignment = self._find_assignment(self.atoms)
             self.assigned = True
 
         assert self.assignment is not None
         return evaluate(variable_node, self.assignment)
 
+    def close(self):
+        """
+        Terminates the processes running starts, if any.
+        """
+        if self.start_pool is not None:
+            self.start_pool.close()
+            self.start_pool = None
+
+    def _find_assignment(self, atoms):
+        if self.start_pool is None and _use_pool(self.workers, self.max_num_resets):
+            self.start_pool = StartPool(self.workers)
+        return find_assignment(self.variable_handler, atoms, self.max_num_resets, self.tol, method=self.method,
+                               workers=self.workers, seed=self.seed, time_limit=self.time_limit,
+                               start_pool=self.start_pool)
 
-def query(variable_handler, prior_atoms, query_atom, max_num_resets=10, tol=10**-3, verbose=False):
+
+def query(variable_handler, prior_atoms, query_atom, max_num_resets=10, tol=10**-3, verbose=False, method='SLSQP'):
     assert isinstance(variable_handler, VariableHandler)
     assert isinstance(query_atom, FormulaNode)
-    prior_assignment, prior_sat = find_assignment(variable_handler, prior_atoms, max_num_resets, tol, verbose)
+    prior_assignment, prior_sat = find_assignment(variable_handler, prior_atoms, max_num_resets, tol, verbose, method)
 
     unique = prior_sat and evaluate(query_atom, prior_assignment).norm < tol
-    all_assignment, sat = find_assignment(variable_handler, prior_atoms + [query_atom], max_num_resets, tol, verbose)
+    all_assignment, sat = find_assignment(variable_handler, prior_atoms + [query_atom], max_num_resets, tol, verbose,
+                                          method)
 
     if unique:
         # If unique answer exists, then enforce satisfiability. Just in case of numerical errors.
@@ -66,22 +111,167 @@ def query(variable_handler, prior_atoms, query_atom, max_num_resets=10, tol=10**
     return assignment, sat, unique
 
 
-def find_assignment(variable_handler, atoms, max_num_resets, tol, verbose=False):
-    init = variable_handler.dict_to_vector()
+def find_assignment(variable_handler, atoms, max_num_resets, tol, verbose=False, method='SLSQP', workers=1, seed=None,
+                    time_limit=None, start_pool=None):
+    """
+    Assignment of the variables under which the sum of the norms of the atoms is less than tol,
+    or None if none is found from max_num_resets starts of the optimizer.
+    The first start is the current values of the variables, and the others are drawn uniformly from [0, 1).
+    If the variable handler has warm start values (see VariableHandler.warm_start),
+    one extra start from them (see VariableHandler.get_warm_start_vector) precedes these starts.
+    With method 'SLSQP', the sum of the norms is minimized directly.
+    With method 'trf' or 'lm', the residuals of the atoms (see AtomProgram.residuals) are minimized
+    with scipy.optimize.least_squares.
+    'trf' uses the soft L1 loss with scale 10*tol, which behaves like the sum of the norms away from the solution,
+    so it is less prone than the plain sum of squares to stall with a few large residuals (e.g. a point off a line).
+    'lm' minimizes the plain sum of squares and needs at least as many residuals as variables;
+    otherwise 'trf' is used.
+
+    With workers > 1 and at least MIN_NUM_STARTS_PER_POOL starts, the starts run concurrently
+    in a pool of processes (start_pool if given, otherwise one created for this call).
+    Results are consumed in the order of the starts, so the assignment is the same as with workers=1
+    for the same seed. As a consequence, there is no early exit on a later start:
+    a later start that reaches tol first is only returned after all earlier starts have failed.
+    Once a start reaches tol (or the time limit passes), the remaining starts of this call are skipped,
+    but the starts already in progress run to completion in their processes.
+
+    :param VariableHandler variable_handler:
+    :param list atoms:
+    :param int max_num_resets: number of starts, apart from the warm start
+    :param float tol:
+    :param bool verbose:
+    :param str method: 'SLSQP', 'trf' or 'lm'
+    :param int workers: number of processes; 1 runs the starts in this process, None uses the number of CPUs
+    :param StartPool start_pool: pool reused across calls (see NumericSolver)
+    :param int seed: seed of the random starts; None draws them from numpy's global random state
+    :param float time_limit: in seconds; no result is awaited after it, and None is returned
+    if no start has reached tol by then (with workers=1, the start in progress is completed)
+    :return dict:
+    """
+    init = np.array(variable_handler.dict_to_vector(), dtype=float)
+    func = compile_atoms(variable_handler, atoms)
+    random_state = np.random if seed is None else np.random.RandomState(seed)
+    starts = _get_starts(init, max_num_resets, random_state, variable_handler.get_warm_start_vector())
+    deadline = None if time_limit is None else time.time() + time_limit
+
+    if not _use_pool(workers, max_num_resets):
+        solutions = _solve_starts(func, starts, tol, method, deadline)
+    elif start_pool is not None:
+        solutions = start_pool.solve_starts(func, starts, tol, method, deadline)
+    else:
+        start_pool = StartPool(workers)
+        try:
+            return _find_assignment_from(variable_handler,
+                                         start_pool.solve_starts(func, starts, tol, method, deadline), tol, verbose)
+        finally:
+            start_pool.close()
+    return _find_assignment_from(variable_handler, solutions, tol, verbose)
+
+
+def _find_assignment_from(variable_handler, solutions, tol, verbose):
+    with closing(solutions):
+        for i, (result, fun) in enumerate(solutions):
+            if verbose:
+                print("iteration %d:" % (i+1))
+                print(result)
+            if fun < tol:
+                return variable_handler.vector_to_dict(result.x)
+    return None
+
+
+def _get_starts(init, max_num_resets, random_state, warm_start=None):
+    if warm_start is not None:
+        yield np.array(warm_start, dtype=float)
+    for idx in range(max_num_resets):
+        yield init if idx == 0 else random_state.rand(len(init))
+
+
+"""
+Below this number of starts, find_assignment runs the starts in this process even if workers > 1,
+because sending the program to the pool costs more than the concurrency saves.
+"""
+MIN_NUM_STARTS_PER_POOL = 4
+
+
+def _use_pool(workers, max_num_resets):
+    return workers != 1 and max_num_resets >= MIN_NUM_STARTS_PER_POOL
 
-    def func(vector):
-        return sum(evaluate(atom, variable_handler.vector_to_dict(vector)).norm for atom in atoms)
 
-    for i in range(max_num_resets):
-        result = minimize(func, init, method='SLSQP', options={'ftol': 10**-9, 'maxiter': 1000})
-        if verbose:
-            print("iteration %d:" % (i+1))
-            print(result)
-        fun = result.fun
-        if fun < tol:
-            break
-        init = np.random.rand(len(init))
+def _solve_starts(func, starts, tol, method, deadline):
+    """
+    Generates (result, fun) of each start in order, until the deadline.
+    """
+    for start in starts:
+        if deadline is not None and time.time() > deadline:
+            return
+        yield _solve(func, start, tol, method)
 
-    if fun > tol:
+
+class StartPool(object):
+    def __init__(self, workers):
+        """
+        Pool of processes solving the starts of find_assignment, which can be reused across calls.
+        The program of each call is pickled once, and unpickled once per process.
+
+        :param int workers: number of processes; None uses the number of CPUs
+        :return:
+        """
+        self.num_calls = 0
+        # Starts of the calls up to this one are skipped by the processes.
+        self.last_cancelled_call = Value('i', 0)
+        self.pool = Pool(workers, _init_worker, (self.last_cancelled_call,))
+
+    def solve_starts(self, func, starts, tol, method, deadline):
+        """
+        Generates (result, fun) of each start in order, until the deadline.
+        The remaining starts are skipped once the generator is closed.
+        """
+        self.num_calls += 1
+        call = self.num_calls
+        data = cPickle.dumps(func, cPickle.HIGHEST_PROTOCOL)
+        starts = list(starts)
+        results = self.pool.imap(_solve_in_worker, [(call, data, start, tol, method) for start in starts])
+        try:
+            for _ in starts:
+                try:
+                    yield results.next(None if deadline is None else max(deadline - time.time(), 0))
+                except TimeoutError:
+                    return
+        finally:
+            self.last_cancelled_call.value = call
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+def _solve(func, init, tol, method):
+    if method == 'SLSQP':
+        result = minimize(func.value_and_gradient, init, method='SLSQP', jac=True,
+                          options={'ftol': 10**-9, 'maxiter': 1000})
+        return result, result.fun
+    result = _solve_least_squares(func, init, method, tol)
+    return result, func(result.x)
+
+
+_worker_state = {}
+
+
+def _init_worker(last_cancelled_call):
+    _worker_state.update(last_cancelled_call=last_cancelled_call, call=None, func=None)
+
+
+def _solve_in_worker(args):
+    call, data, start, tol, method = args
+    if call <= _worker_state['last_cancelled_call'].value:
         return None
-    return variable_handler.vector_to_dict(result.x)
+    if _worker_state['call'] != call:
+        _worker_state.update(call=call, func=cPickle.loads(data))
+    return _solve(_worker_state['func'], start, tol, method)
+
+
+def _solve_least_squares(func, init, method, tol):
+    if method == 'lm' and len(func.residuals(init)) >= len(init):
+        return least_squares(func.residuals, init, jac=func.jacobian, method='lm', max_nfev=1000)
+    return least_squares(func.residuals, init, jac=func.jacobian, method='trf', loss='soft_l1', f_scale=10*tol,
+                         max_nfev=1000)
@@ -1,3 +1,5 @@
+import numbers
+
 import numpy as np
 from geosolver.text2.ontology import FormulaNode, VariableSignature, function_signatures
 
@@ -8,6 +10,50 @@ class VariableHandler(object):
         self.variables = {}
         self.entities = []
         self.named_entities = {}
+        self.warm_start_values = {}
+
+    def warm_start(self, assignment):
+        """
+        Sets the warm start values of the variables named in the assignment, e.g. CoreParse.variable_assignment,
+        including those added later (see get_warm_start_vector).
+        Points map to their "_x" and "_y" variables and numbers to the variable of the same name.
+        Pixel values are normalized to the range of the random initialization:
+        points are translated so that their minimum coordinates are 0,
+        and points and numbers (e.g. radii) are divided by the largest extent of the points.
+        The initial values of the variables are not changed.
+
+        :param dict assignment: {name: point or number}
+        :return:
+        """
+        points = {name: value for name, value in assignment.iteritems() if not isinstance(value, numbers.Number)}
+        lengths = {name: value for name, value in assignment.iteritems() if isinstance(value, numbers.Number)}
+        coordinates = np.array([(point[0], point[1]) for point in points.values()], dtype=float).reshape(-1, 2)
+        if len(coordinates) > 0:
+            offset = coordinates.min(0)
+            scale = (coordinates.max(0) - offset).max()
+        else:
+            offset = np.zeros(2)
+            scale = max([abs(value) for value in lengths.values()] + [0])
+        if scale == 0:
+            scale = 1.0
+
+        for name, point in points.iteritems():
+            self.warm_start_values[name + "_x"] = (point[0] - offset[0]) / scale
+            self.warm_start_values[name + "_y"] = (point[1] - offset[1]) / scale
+        for name, value in lengths.iteritems():
+            self.warm_start_values[name] = value / scale
+
+    def get_warm_start_vector(self):
+        """
+        Values of the variables in the order of dict_to_vector, where the warm start values (see warm_start)
+        replace the initial values, or None if no variable has a warm start value.
+        Variables without one (e.g. lengths only given by the text) keep their initial values.
+
+        :return list:
+        """
+        if not any(name in self.warm_start_values for name in self.variables):
+            return None
+        return [self.warm_start_values.get(name, value) for name, value in self.variables.iteritems()]
 
     def number(self, name, init=None):
         assert name not in self.variables
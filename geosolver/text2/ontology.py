@@ -242,6 +242,7 @@ function_signature_tuples = (
     ('IsChordOf', 'truth', ['line', 'circle']),
     ('Tangent', 'truth', ['line', 'circle']),
     ('RadiusNumOf', 'number', ['circle']),
+    ('RadiusOf', 'number', ['circle']),
     ('IsRadiusNumOf', 'truth', ['number', 'circle']),
     ('IsRadiusLineOf', 'truth', ['line', 'circle']),
     ('PointLiesOnLine', 'truth', ['point', 'line']),
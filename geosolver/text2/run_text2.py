@@ -41,7 +41,7 @@ def test_trans():
     for pk, question in questions.iteritems():
         label_data = geoserver_interface.download_labels(pk)[pk]
         diagram = open_image(question.diagram_path)
-        graph_parse = diagram_to_graph_parse(diagram)
+        graph_parse = diagram_to_graph_parse(diagram, use_cache=True)
         match_parse = parse_match_from_known_labels(graph_parse, label_data)
         for number, sentence_words in question.sentence_words.iteritems():
             syntax_parse = SyntaxParse(sentence_words, None)
@@ -1,12 +1,16 @@
 """
 Preprocessing utils to obtain appropriate format for question text and diagram.
 """
+from io import BytesIO
 import os
+import tarfile
 import tempfile
 import re
+import zipfile
 
 import cv2
 import networkx as nx
+import numpy as np
 from PIL import Image
 import requests
 from geosolver import settings
@@ -65,27 +69,96 @@ def block_display():
 
 
 def open_image(filepath, grayscale=True):
-    basepath, ext = os.path.splitext(filepath)
-    if ext != ".png":
-        newpath = basepath + ".png"
-        fp = Image.open(filepath)
-        fp.save(newpath)
-        filepath = newpath
-    if grayscale:
-        image = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
-    else:
-        image = cv2.imread(filepath, cv2.IMREAD_COLOR)
-    return image
+    """
+    Decodes the image file without writing any intermediate file.
+    The file is memory-mapped and decoded in place by cv2 (see decode_image).
+
+    :param str filepath:
+    :param bool grayscale:
+    :return np.ndarray: grayscale or BGR image, or None if the file could not be read or decoded
+    """
+    try:
+        if os.path.getsize(filepath) == 0:
+            return None
+        buffer_ = np.memmap(filepath, dtype=np.uint8, mode='r')
+    except (OSError, IOError):
+        return None
+    try:
+        return decode_image(buffer_, grayscale=grayscale)
+    finally:
+        del buffer_
+
 
 def open_image_from_file(file, grayscale=True):
-    fp = Image.open(file)
-    _, path = tempfile.mkstemp(suffix=".png")
-    fp.save(path)
+    """
+    Decodes the image in a file-like object (e.g. a member of a zip or tar archive) without writing any file.
+
+    :param file: file-like object with read()
+    :param bool grayscale:
+    :return np.ndarray: grayscale or BGR image, or None if the file could not be decoded
+    """
+    return decode_image(file.read(), grayscale=grayscale)
+
+
+def decode_image(data, grayscale=True):
+    """
+    Decodes the encoded image in memory with cv2.imdecode.
+    Formats that cv2 cannot decode (e.g. gif) are decoded with PIL, and converted to cv2's layout.
+
+    :param data: bytes, bytearray, buffer, 1-D uint8 numpy array, or file-like object with read()
+    :param bool grayscale:
+    :return np.ndarray: grayscale or BGR image, or None if the data could not be decoded
+    """
+    if hasattr(data, 'read'):
+        data = data.read()
+    if isinstance(data, np.ndarray):
+        buffer_ = data.reshape(-1).view(np.uint8)
+    else:
+        buffer_ = np.frombuffer(data, dtype=np.uint8)
+    if len(buffer_) == 0:
+        return None
+    flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    image = cv2.imdecode(buffer_, flags)
+    if image is not None:
+        return image
+
+    try:
+        fp = Image.open(BytesIO(buffer_.tobytes()))
+        rgb_image = np.asarray(fp.convert('RGB'))
+    except IOError:
+        return None
     if grayscale:
-        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        return cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY)
     else:
-        image = cv2.imread(path, cv2.IMREAD_COLOR)
-    return image
+        return cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
+
+
+def open_images_from_archive(filepath, grayscale=True):
+    """
+    Iterates over (name, image) of the images in a zip or tar archive, decoding each member in memory.
+    Members that cannot be decoded as images are skipped.
+
+    :param str filepath:
+    :param bool grayscale:
+    :return:
+    """
+    if zipfile.is_zipfile(filepath):
+        with zipfile.ZipFile(filepath) as archive:
+            for name in archive.namelist():
+                if not name.endswith('/'):
+                    image = decode_image(archive.read(name), grayscale=grayscale)
+                    if image is not None:
+                        yield name, image
+    else:
+        archive = tarfile.open(filepath)
+        try:
+            for member in archive:
+                if member.isfile():
+                    image = decode_image(archive.extractfile(member), grayscale=grayscale)
+                    if image is not None:
+                        yield member.name, image
+        finally:
+            archive.close()
 
 
 def save_image(image, ext=".png"):